@@ -0,0 +1,90 @@
+#!/usr/bin/python3.8
+'''
+Copyright 2018 by EKDF Consulting and Dmitri Fedorov
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+@author: Dmitri Fedorov
+@copyright: 2020 by EKDF Consulting and Dmitri Fedorov
+@file cowbatch.py
+'''
+
+# runs cowobench for every game found in one or more directories on one process pool
+
+OUTPUT_DIRECTORY = 'games'
+
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import os, time
+import cowobench
+
+Game = namedtuple('Game', 'game_id, dir, with_impulses, out_dir, map_file_count')
+
+
+def get_games(dirs: [], out_dir: str) -> []:
+    """Finds every game in the directories, impulse files go with a game only if it is alone in its directory"""
+    games = []
+    out_dirs = set()
+    for dir in dirs:
+        game_ids = cowobench.get_game_ids(dir)
+        with_impulses = len(game_ids) == 1
+        if len(game_ids) > 1:
+            print('Directory {0} has games {1}, skipping its impulse files'.format(dir, ', '.join(game_ids)))
+        for game_id in game_ids:
+            game_out_dir = os.path.join(out_dir, game_id)
+            if game_out_dir in out_dirs:
+                game_out_dir = '{0}-{1}'.format(game_out_dir, len(out_dirs))
+            out_dirs.add(game_out_dir)
+            _, map_files = cowobench.get_all_map_files(dir, game_id, with_impulses)
+            games.append(Game(game_id, dir, with_impulses, game_out_dir, len(map_files)))
+    return games
+
+
+def process_game(game: Game, do_recon: bool, include_units: [], exclude_units: []) -> float:
+    """Parses, renders and encodes one game in a worker process"""
+    start_time = time.perf_counter()
+    cowobench.main(do_recon, include_units, exclude_units, game.dir, game.game_id, game.out_dir, game.with_impulses)
+    return time.perf_counter() - start_time
+
+
+def main(dirs: [], out_dir: str, jobs: int, do_recon: bool, include_units: [], exclude_units: []):
+    games = get_games(dirs, out_dir)
+    print('Found {0} games in {1} directories'.format(len(games), len(dirs)))
+    # longest games first so that short ones fill the pool at the end
+    games.sort(key=lambda x: x.map_file_count, reverse=True)
+    failed = 0
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = { pool.submit(process_game, game, do_recon, include_units, exclude_units): game for game in games }
+        for future in as_completed(futures):
+            game = futures[future]
+            try:
+                print('Game {0} done in {1:.1f}s: {2}'.format(game.game_id, future.result(), game.out_dir))
+            except Exception as ex:
+                failed += 1
+                print('Game {0} failed: {1}'.format(game.game_id, ex))
+    return failed
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Generate recon and result videos for every game.')
+    parser.add_argument('dirs', help='directories with result files', nargs='*', default=[cowobench.RESULT_DIRECTORY])
+    parser.add_argument('-o', '--out', help='output directory, one folder per game', default=OUTPUT_DIRECTORY)
+    parser.add_argument('-j', '--jobs', help='worker processes', type=int, default=os.cpu_count())
+    parser.add_argument('-n', '--no-recon', help='do not generate recon', dest='recon', action='store_false')
+    parser.add_argument('-i', '--include', help='draw only units matching this name or faction, e.g. MD_NCR_*',
+                        action='append', default=[])
+    parser.add_argument('-x', '--exclude', help='do not draw units matching this name or faction',
+                        action='append', default=[])
+    args = parser.parse_args()
+    exit(1 if main(args.dirs, args.out, args.jobs, args.recon, args.include, args.exclude) else 0)
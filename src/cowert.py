@@ -40,6 +40,7 @@ from html.parser import HTMLParser
 from PIL import Image, ImageDraw, ImageFont, ImageOps
 from collections import namedtuple
 import imageio, numpy, os, datetime, itertools
+import cowprof
 
 known_units = []
 known_digs = []
@@ -47,6 +48,7 @@ known_digs = []
 XY = namedtuple('XY', 'x, y')
 UnitIconPosition = namedtuple('UnitIconPosition', 'icon, position')
 
+@cowprof.profiled
 def get_table(data: str, is_turn_map: bool) -> []:
     """Give the data, yields one curr_table"""
 
@@ -99,6 +101,7 @@ def html_colour_to_rgba(html_colour: str) -> ():
     return tuple([int(x, 16) for x in (html_colour[:2], html_colour[2:4], html_colour[4:], '0')])
 
 
+@cowprof.profiled
 def write_on_cell(cell_image: Image, cell_content: str,
                   is_zero_cell: bool=False, zero_call_label: str=None):
     """Write text on one cell"""
@@ -120,6 +123,7 @@ def write_on_cell(cell_image: Image, cell_content: str,
         draw_context.text(CELL_POINTS_POSITION, realm_points, font=CELL_POINTS_FONT, fill=TRANSPARENT_FILL)
 
 
+@cowprof.profiled
 def write_unit_name(cell_image: Image, unit_name: str):
     """Write text on one cell"""
     CELL_POINTS_FONT_TYPE = 'seguisym.ttf'
@@ -140,6 +144,7 @@ def mark_attacked_unit(cell_image: Image, table_index: int, cell_index: int, row
     mark_unit('dagger-knife.png', cell_image, table_index, cell_index, row_index)
 
 
+@cowprof.profiled
 def mark_unit(mark_filename: str, cell_image: Image, table_index: int, cell_index: int, row_index: int):
     dir_path = os.path.dirname(os.path.realpath(__file__))
     cell_icon = Image.open(os.path.join(dir_path, mark_filename)).resize((35, 35))
@@ -148,6 +153,7 @@ def mark_unit(mark_filename: str, cell_image: Image, table_index: int, cell_inde
     known_units.append(UnitIconPosition(cell_icon, XY(cell_index, row_index)))
 
 
+@cowprof.profiled
 def mark_dig(cell_image: Image, table_index: int, cell_index: int, row_index: int):
     dir_path = os.path.dirname(os.path.realpath(__file__))
     cell_icon = Image.open(os.path.join(dir_path, 'dig.png')).resize((35, 35))
@@ -156,6 +162,7 @@ def mark_dig(cell_image: Image, table_index: int, cell_index: int, row_index: in
     known_digs.append(UnitIconPosition(cell_icon, XY(cell_index, row_index)))
 
 
+@cowprof.profiled
 def write_table_index(cell_image: Image, table_index: int):
     """Write table index on one cell"""
     CELL_POINTS_FONT_TYPE = 'arialbd.ttf'
@@ -208,6 +215,7 @@ def get_one_row_image(table_index: int, zero_cell_label: str, row_index: int, ro
     return row_image
 
 
+@cowprof.profiled
 def read_turnmap(turnmap_filename):
     with open(turnmap_filename) as result_file:
         return result_file.read().replace('<b>', ' ').replace('</b>', ' ')\
@@ -238,6 +246,7 @@ def get_named_files(name: str, dir_name: str):
             pass
 
 
+@cowprof.profiled
 def get_row_image(table_index: int, zero_cell_label: str, row_index: int, row_data: []) -> Image:
     row_image = Image.new(RGBA, (REALM_WIDTH * REALMS_MAX_X, REALM_HEIGHT), EMPTY_IMAGE_RGBA)
     for cell_index, cell_data in enumerate(row_data):
@@ -260,6 +269,7 @@ def get_row_image(table_index: int, zero_cell_label: str, row_index: int, row_da
     return row_image
 
 
+@cowprof.profiled
 def get_one_map(impulse_files) -> Image:
     for map_label, is_turn_map, turnmap_filename in impulse_files:
         print('Processing file {0}...'.format(turnmap_filename))
@@ -274,6 +284,7 @@ def get_one_map(impulse_files) -> Image:
             yield one_map
 
 
+@cowprof.profiled
 def written(map_images, number_of_turns):
     if map_images and len(map_images) > 0:
         video_filename = 'last-{0}-turns-{1}.mp4'.format(number_of_turns, datetime.date.today())
@@ -307,5 +318,15 @@ def main(result_directory, number_of_turns):
 
 
 if __name__ == '__main__':
-    main(RESULT_DIRECTORY, NUMBER_OF_TURNS)
+    import argparse
+    parser = argparse.ArgumentParser(description='Make a movie of the last turns.')
+    parser.add_argument('-d', '--dir', help='working directory', default=RESULT_DIRECTORY)
+    parser.add_argument('-t', '--turns', help='number of last turns', type=int, default=NUMBER_OF_TURNS)
+    parser.add_argument('--profile', help='write per stage timings to a JSON report', action='store_true')
+    args = parser.parse_args()
+    if args.profile:
+        cowprof.start()
+    main(args.dir, args.turns)
+    if args.profile:
+        cowprof.write_report('cowert')
 
@@ -19,6 +19,8 @@ limitations under the License.
 @file: cowfart.py
 '''
 
+from __future__ import annotations
+
 
 RESULT_DIRECTORY = "C:\\Users\\dfedorov\\!nosync\\!cow"
 
@@ -28,6 +30,11 @@ REALM_BORDER = 1
 REALMS_MAX_X = 38
 REALMS_MAX_Y = 38
 PLAN_LINE_WIDTH = 10
+PLAN_PALETTE_SIZE = 64
+PLAN_PALETTE_LEVELS = 16
+# least CIELAB distance of a plan line to the map colours, and the shades tried to get there
+PLAN_CONTRAST = 20
+PLAN_SHADE_STEPS = (0.15, 0.3, 0.45, 0.6)
 TOTAL_IMPULSES = 10
 
 EMPTY_IMAGE_RGBA = (255, 255, 255)
@@ -35,31 +42,53 @@ RGBA = 'RGB'
 HOME_COLOUR = '#666600'
 HOME_X = 31
 HOME_Y = 7
+ORDERS_FILE_PREFIX = 'CoW_Orders_'
+BASE_CACHE_DIRECTORY = '.cowfart'
+# bump when the map rendering changes, cached base maps of older versions are ignored
+BASE_CACHE_VERSION = 2
 
 do_recon = True
 known_units = []
 known_digs = []
-cell_colours = []
+cell_colours = set()
+plan_palette = []
 
 from html.parser import HTMLParser
-from PIL import Image, ImageDraw, ImageFont, ImageOps
 from string import ascii_uppercase
-import imageio
-import numpy
 import os
+import re
+import zlib
+import hashlib
 import datetime
 import itertools
 from collections import namedtuple
+import cowprof
+from factions import FACTION_HOME_REALM_MAP
 
+# imaging modules are imported by import_imaging() only when a plan image is drawn
+Image = ImageDraw = ImageFont = ImageOps = None
 
 Move = namedtuple('Move', 'unit, limbo, impulses, at')
 XY_Move = namedtuple('XY_Move', 'unit, xy_moves')
 Upgrade = namedtuple('Upgrade', 'unit, type, cost')
-TurnOrders = namedtuple('TurnOrders', 'turn, faction, commands')
+Command = namedtuple('Command', 'unit, verb, args')
+TurnOrders = namedtuple('TurnOrders', 'turn, faction, commands, errors', defaults=((),))
+OrdersError = namedtuple('OrdersError', 'filename, line_number, line, reason')
 XY = namedtuple('XY', 'x, y')
 UnitIconPosition = namedtuple('UnitIconPosition', 'icon, position')
 
+ORDERS_FILENAME = re.compile(r'^CoW_Orders_Game_(.+)_Turn_(\d+)_([^._]+)[._]')
+UNIT_AT = re.compile(r'\bat\s+(Limbo|x(\d+)y(\d+))', re.IGNORECASE)
+UPGRADE_COST = re.compile(r'\bcost\s+is\s+(\d+)', re.IGNORECASE)
+
+
+def import_imaging():
+    global Image, ImageDraw, ImageFont, ImageOps
+    if Image is None:
+        from PIL import Image, ImageDraw, ImageFont, ImageOps
 
+
+@cowprof.profiled
 def get_table(data: str, is_turn_map: bool) -> []:
     """Give the data, yields one curr_table"""
 
@@ -112,6 +141,7 @@ def html_colour_to_rgb(html_colour: str) -> ():
     return tuple([int(x, 16) for x in (html_colour[:2], html_colour[2:4], html_colour[4:])])
 
 
+@cowprof.profiled
 def write_on_cell(cell_image: Image, cell_content: str,
                   is_zero_cell: bool=False, zero_call_label: str=None):
     """Write text on one cell"""
@@ -133,6 +163,7 @@ def write_on_cell(cell_image: Image, cell_content: str,
         draw_context.text(CELL_POINTS_POSITION, realm_points, font=CELL_POINTS_FONT, fill=TRANSPARENT_FILL)
 
 
+@cowprof.profiled
 def write_unit_name(cell_image: Image, unit_name: str):
     """Write text on one cell"""
     CELL_POINTS_FONT_TYPE = 'seguisym.ttf'
@@ -153,6 +184,7 @@ def mark_attacked_unit(cell_image: Image, table_index: int, cell_index: int, row
     mark_unit('dagger-knife.png', cell_image, table_index, cell_index, row_index)
 
 
+@cowprof.profiled
 def mark_unit(mark_filename: str, cell_image: Image, table_index: int, cell_index: int, row_index: int):
     dir_path = os.path.dirname(os.path.realpath(__file__))
     cell_icon = Image.open(os.path.join(dir_path, mark_filename)).resize((35, 35))
@@ -162,6 +194,7 @@ def mark_unit(mark_filename: str, cell_image: Image, table_index: int, cell_inde
         known_units.append(UnitIconPosition(cell_icon, XY(cell_index, row_index)))
 
 
+@cowprof.profiled
 def mark_dig(cell_image: Image, table_index: int, cell_index: int, row_index: int):
     dir_path = os.path.dirname(os.path.realpath(__file__))
     cell_icon = Image.open(os.path.join(dir_path, 'dig.png')).resize((35, 35))
@@ -170,6 +203,7 @@ def mark_dig(cell_image: Image, table_index: int, cell_index: int, row_index: in
     known_digs.append(UnitIconPosition(cell_icon, XY(cell_index, row_index)))
 
 
+@cowprof.profiled
 def write_table_index(cell_image: Image, table_index: int):
     """Write table index on one cell"""
     CELL_POINTS_FONT_TYPE = 'arialbd.ttf'
@@ -181,6 +215,7 @@ def write_table_index(cell_image: Image, table_index: int):
     draw_context.text(CELL_POINTS_POSITION, str(table_index), font=CELL_POINTS_FONT, fill=TEXT_FILL)
 
 
+@cowprof.profiled
 def get_one_row_image(table_index: int, zero_cell_label: str, row_index: int, row_data: [], prev_row_data: []) -> Image:
     """Build one row image from the row data"""
     global cell_colours
@@ -188,8 +223,7 @@ def get_one_row_image(table_index: int, zero_cell_label: str, row_index: int, ro
     for cell_index, cell_data in enumerate(row_data):
         cell_content, cell_colour = cell_data
         cell_colour = html_colour_to_rgb(cell_colour)
-        if not cell_colour in cell_colours:
-            cell_colours.append(cell_colour)
+        cell_colours.add(cell_colour)
         cell_image = Image.new(RGBA,
                                (REALM_WIDTH - REALM_BORDER * 2, REALM_HEIGHT - REALM_BORDER * 2),
                                cell_colour)
@@ -242,44 +276,86 @@ def get_impulses(commands: str):
                     if teleport_command[-1] == ')':
                         break
                 result.append(''.join(teleport_command))
-    except Exception as ex:
-        print(ex)
+    except StopIteration:
+        # unterminated teleport, get_order reports it
+        pass
     return result
 
 
+def get_orders_header(orders_filename: str) -> ():
+    """Game, turn and faction from an orders file name like CoW_Orders_Game_g7_Turn_9_NCR.txt or its variant _NCR_b.txt"""
+    match = ORDERS_FILENAME.match(os.path.basename(orders_filename))
+    if not match:
+        return None, None, None
+    return match.group(1), int(match.group(2)), match.group(3)
+
+
+def get_order(tokens: [], comment: str, home: XY) -> ():
+    """One order as a Move, Upgrade or Command record, or the reason it is malformed"""
+    verb = tokens[0].upper()
+    if verb in ['MOV', 'UPG'] and len(tokens) < 3:
+        return None, 'expected {0} <unit> <{1}>'.format(verb, 'impulses' if verb == 'MOV' else 'type')
+    if verb == 'MOV':
+        # expect MOV MD_NCR_3 ESE.......  # Unit is at x35y11, has
+        impulses = get_impulses(tokens[2])
+        if ''.join('T' + x if x.startswith('(') else x for x in impulses) != tokens[2]:
+            return None, 'unknown or unterminated impulse in {0}'.format(tokens[2])
+        if len(impulses) != TOTAL_IMPULSES:
+            return None, 'expected {0} impulses in {1}'.format(TOTAL_IMPULSES, tokens[2])
+        unknown = [x for x in impulses if x not in moves_map]
+        if unknown:
+            return None, 'unknown teleport {0}'.format(unknown[0])
+        match = UNIT_AT.search(comment)
+        if not match:
+            return None, 'no unit position in the comment'
+        limbo = match.group(2) is None
+        return Move(tokens[1], limbo, impulses, home if limbo else XY(int(match.group(2)), int(match.group(3)))), None
+    if verb == 'UPG':
+        # expect UPG MD_NCR_7 SK # cost is 16 rp...
+        match = UPGRADE_COST.search(comment)
+        if not match:
+            return None, 'no upgrade cost in the comment'
+        return Upgrade(tokens[1], tokens[2], int(match.group(1))), None
+    return Command(tokens[1] if len(tokens) > 1 else None, verb, tuple(tokens[2:])), None
+
+
+@cowprof.profiled
+def get_orders(orders_dir: str, orders_filename) -> TurnOrders:
+    """Reads all orders of one file in one pass, malformed lines are reported and skipped"""
+    orders_path = os.path.join(orders_dir, orders_filename)
+    _, turn, faction = get_orders_header(orders_path)
+    home = FACTION_HOME_REALM_MAP.get(faction, XY(HOME_X, HOME_Y))
+    commands = []
+    errors = []
+    with open(orders_path, 'r') as orders_file:
+        for line_number, line in enumerate(orders_file, 1):
+            order, _, comment = line.strip().partition('#')
+            tokens = order.split()
+            if not tokens:
+                continue
+            command, reason = get_order(tokens, comment, home)
+            if command:
+                commands.append(command)
+            else:
+                errors.append(OrdersError(orders_path, line_number, line.rstrip(), reason))
+    return TurnOrders(turn, faction, commands, errors)
+
+
+def get_all_orders(orders_dir: str) -> []:
+    """Orders of every faction and turn in the directory"""
+    orders_filenames = [x for x in os.listdir(orders_dir) if x.startswith(ORDERS_FILE_PREFIX)]
+    all_orders = [get_orders(orders_dir, x) for x in orders_filenames]
+    return sorted(all_orders, key=lambda x: (x.turn or 0, x.faction or ''))
+
+
 def get_upgrades(orders_dir: str, orders_filename) -> TurnOrders:
-    with open(os.path.join(orders_dir, orders_filename), 'r') as orders_file:
-        commands = []
-        for line in orders_file:
-            if not line.lstrip().startswith('#') and len(line.strip()) > 0:
-                upgrade_tokens = list(filter(None, line.split(' ')))
-                if upgrade_tokens[0] in ['UPG', 'upg']:
-                    # expect UPG MD_NCR_7 SK # cost is 16 rp...
-                    upgrade_cost = int(upgrade_tokens[6])
-                    commands.append(Upgrade(upgrade_tokens[1], upgrade_tokens[2], upgrade_cost))
-        return TurnOrders(None, 'NCR', commands)
+    orders = get_orders(orders_dir, orders_filename)
+    return orders._replace(commands=[x for x in orders.commands if isinstance(x, Upgrade)])
 
 
 def get_moves(orders_dir: str, orders_filename) -> TurnOrders:
-    with open(os.path.join(orders_dir, orders_filename), 'r') as orders_file:
-        commands = []
-        for line in orders_file:
-            if not line.lstrip().startswith('#') and len(line.strip()) > 0:
-                order_tokens = list(filter(None, line.strip().split(' ')))
-                if order_tokens[0] in ['MOV', 'mov']:
-                    # expect MOV MD_NCR_3 ESE.......  # Unit is at x35y11, has
-                    unit_at = order_tokens[7].strip(',')
-                    if unit_at in ['Limbo']:
-                        unit_at_x = HOME_X
-                        unit_at_y = HOME_Y
-                    else:
-                        unit_at_x = unit_at.split('y')[0].strip('x')
-                        unit_at_y = unit_at.split('y')[1]
-                    commands.append(Move(order_tokens[1],
-                                         unit_at in ['Limbo'],
-                                         get_impulses(order_tokens[2]),
-                                         XY(int(unit_at_x), int(unit_at_y))))
-        return TurnOrders(None, 'NCR', commands)
+    orders = get_orders(orders_dir, orders_filename)
+    return orders._replace(commands=[x for x in orders.commands if isinstance(x, Move)])
 
 
 def unit_moved(impulses):
@@ -313,12 +389,14 @@ def get_named_files(name: str, dir_name: str):
         except:
             pass
 
+@cowprof.profiled
 def read_file(turnmap_filename):
     result = open(turnmap_filename).read()
     result = result.replace('<b>', ' ').replace('</b>', ' ').replace('<i>', ' ').replace('</i>', ' ')
     return result
 
 
+@cowprof.profiled
 def get_maps(map_label: str, is_turn_map: bool, turnmap_filename: str) -> Image:
     """builds one map"""
     prev_imp_table = None
@@ -336,35 +414,58 @@ def get_maps(map_label: str, is_turn_map: bool, turnmap_filename: str) -> Image:
         yield one_map
 
 
-curr_rgb_int = (None, None, None)
-import random
-random.seed()
-
-def too_close(curr_rgb_int):
-    global cell_colours
-    MAX_DIFFERENCE = 5
-    if curr_rgb_int in cell_colours:
-        return True
-    rc, gc, bc = curr_rgb_int
-    for re, ge, be in cell_colours:
-        if (abs(re - rc) <= MAX_DIFFERENCE) and \
-            (abs(ge - gc) <= MAX_DIFFERENCE) and \
-            (abs(be - bc) <= MAX_DIFFERENCE):
-            return True
-    return False
-
-
-def get_next_colour():
-    global curr_rgb_int
-    global cell_colours
-    while True:
-        curr_rgb_int = tuple([random.randint(1, 255) for _ in curr_rgb_int])
-        if too_close(curr_rgb_int):
-            continue
-        else:
-            cell_colours.append(curr_rgb_int)
-            break
-    return "#" + "".join(['{0:02x}'.format(i) for i in curr_rgb_int])
+def rgb_to_lab(rgb: numpy.ndarray) -> numpy.ndarray:
+    """CIELAB of sRGB colours, D65 white"""
+    srgb = rgb / 255.0
+    linear = numpy.where(srgb > 0.04045, ((srgb + 0.055) / 1.055) ** 2.4, srgb / 12.92)
+    xyz = linear @ numpy.array([[0.4124, 0.3576, 0.1805],
+                                [0.2126, 0.7152, 0.0722],
+                                [0.0193, 0.1192, 0.9505]]).T
+    xyz /= numpy.array([0.95047, 1.0, 1.08883])
+    f = numpy.where(xyz > 216 / 24389, numpy.cbrt(xyz), (24389 / 27 * xyz + 16) / 116)
+    return numpy.stack([116 * f[:, 1] - 16, 500 * (f[:, 0] - f[:, 1]), 200 * (f[:, 1] - f[:, 2])], axis=1)
+
+
+def get_plan_palette(size: int=PLAN_PALETTE_SIZE) -> []:
+    """Colours picked one by one as far as possible from black, white and each other, the same on every map"""
+    if len(plan_palette) == size:
+        return plan_palette
+    import_numpy()
+    levels = numpy.linspace(0, 255, PLAN_PALETTE_LEVELS).round()
+    candidates = numpy.stack(numpy.meshgrid(levels, levels, levels, indexing='ij'), axis=-1).reshape(-1, 3)
+    candidates_lab = rgb_to_lab(candidates)
+    # distance of every candidate to its nearest colour already in the palette
+    nearest = numpy.full(len(candidates), numpy.inf)
+    for neutral_lab in rgb_to_lab(numpy.array([[0, 0, 0], [255, 255, 255]], dtype=float)):
+        nearest = numpy.minimum(nearest, numpy.linalg.norm(candidates_lab - neutral_lab, axis=1))
+    plan_palette.clear()
+    for _ in range(0, min(size, len(candidates))):
+        picked = int(numpy.argmax(nearest))
+        plan_palette.append('#' + ''.join('{0:02x}'.format(int(x)) for x in candidates[picked]))
+        nearest = numpy.minimum(nearest, numpy.linalg.norm(candidates_lab - candidates_lab[picked], axis=1))
+    return plan_palette
+
+
+def get_contrast_colour(html_colour: str, map_colours_lab: numpy.ndarray) -> str:
+    """The colour, or its nearest shade towards black or white at least PLAN_CONTRAST from every map colour"""
+    rgb = numpy.array(html_colour_to_rgb(html_colour), dtype=float)
+    shades = numpy.array([rgb] + [rgb + (target - rgb) * step for step in PLAN_SHADE_STEPS for target in (0.0, 255.0)])
+    if len(map_colours_lab) == 0:
+        return html_colour
+    nearest = numpy.min(numpy.linalg.norm(rgb_to_lab(shades)[:, None, :] - map_colours_lab[None, :, :], axis=2), axis=1)
+    far = numpy.flatnonzero(nearest >= PLAN_CONTRAST)
+    picked = int(far[0]) if len(far) else int(numpy.argmax(nearest))
+    return '#' + ''.join('{0:02x}'.format(int(round(x))) for x in shades[picked])
+
+
+def get_unit_colours(unit_names: [], map_colours: []) -> {}:
+    """Palette colour of every unit by its name alone, so it is the same in every plan whatever other
+    units there are, shaded only where the map has a colour too close to it"""
+    import_numpy()
+    palette = get_plan_palette()
+    map_colours_lab = rgb_to_lab(numpy.array(sorted(map_colours), dtype=float).reshape(-1, 3))
+    return { unit_name: get_contrast_colour(palette[zlib.crc32(unit_name.encode()) % len(palette)], map_colours_lab)
+             for unit_name in unit_names }
 
 
 def get_unit_moves(unit_moves):
@@ -378,11 +479,13 @@ def get_unit_moves(unit_moves):
     return result
 
 
+@cowprof.profiled
 def draw_plan(xy_moves, last_image: Image) -> Image:
     draw_context = ImageDraw.Draw(last_image)
+    unit_colours = get_unit_colours(xy_moves.keys(), cell_colours)
     for unit_name, unit_moves in xy_moves.items():
         draw_context.line(get_unit_moves(unit_moves),
-                          fill=get_next_colour(),
+                          fill=unit_colours[unit_name],
                           width=PLAN_LINE_WIDTH)
     return last_image
 
@@ -390,6 +493,9 @@ def draw_plan(xy_moves, last_image: Image) -> Image:
 moves_map = { 
     '.': lambda curr: XY(curr.x, curr.y),
     'H': lambda curr: XY(curr.x, curr.y),
+    'D': lambda curr: XY(curr.x, curr.y),
+    'U': lambda curr: XY(curr.x, curr.y),
+    'C': lambda curr: XY(curr.x, curr.y),
     'N': lambda curr: XY(curr.x, curr.y-1),
     'S': lambda curr: XY(curr.x, curr.y+1),
     'W': lambda curr: XY(curr.x-1, curr.y),
@@ -414,16 +520,31 @@ def get_teleports():
 def teleport(xy):
     return lambda _: xy
 
+teleports = {}
 for name, x, y in get_teleports():
+    teleports[name] = XY(x, y)
     moves_map[name] = teleport(XY(x, y))
 
+# impulse steps for simulate(), every other impulse keeps the unit in place
+impulse_steps = {
+    'N': XY(0, -1),
+    'S': XY(0, 1),
+    'W': XY(-1, 0),
+    'E': XY(1, 0),
+    }
+
+
+def is_staying_in_limbo(unit_moves: Move) -> bool:
+    return unit_moves.limbo and ''.join(unit_moves.impulses) == 'H' + '.' * (TOTAL_IMPULSES - 1)
 
+
+@cowprof.profiled
 def get_xy_moves(moves):
     # transform into XY movements
     result = {}
     for unit_moves in moves:
         # 'unit, limbo, impulses, at'
-        if unit_moves.limbo and (unit_moves.impulses == 'H.........'):
+        if is_staying_in_limbo(unit_moves):
             continue
         curr = unit_moves.at
         unit_xy_moves = [curr]
@@ -441,24 +562,289 @@ def unit_move_const(unit_moves):
     result += sum(1 for i, _ in enumerate(unit_moves) if not unit_moves[i] == unit_moves[i-1])
     return result
 
-def main(orders_dir, orders_filename):
-    xy_moves = get_xy_moves(get_moves(orders_dir, orders_filename).commands)
-
+def print_orders_errors(orders: TurnOrders):
+    for error in orders.errors:
+        print('{0}:{1}: {2}: {3}'.format(error.filename, error.line_number, error.reason, error.line))
+
+
+Simulation = namedtuple('Simulation', 'units, x, y, costs, collisions, wall_moves, digs')
+Evaluation = namedtuple('Evaluation', 'orders_filename, faction, move_cost, upgrade_cost, dig_points, collisions, '
+                                      'wall_moves, positions, errors')
+
+numpy = None
+
+
+def import_numpy():
+    global numpy
+    if numpy is None:
+        import numpy
+
+
+def get_impulse_tables() -> ():
+    """Impulse names and per impulse code step, teleport flag and teleport target"""
+    names = list(moves_map.keys())
+    steps = numpy.array([impulse_steps.get(x, XY(0, 0)) for x in names], dtype=numpy.int32)
+    is_teleport = numpy.array([x in teleports for x in names])
+    targets = numpy.array([teleports.get(x, XY(0, 0)) for x in names], dtype=numpy.int32)
+    return { x: code for code, x in enumerate(names) }, steps, is_teleport, targets
+
+
+def get_positions(starts: numpy.ndarray, steps: numpy.ndarray, resets: numpy.ndarray, targets: numpy.ndarray):
+    """Positions along one axis, a cumulative sum of steps restarted at every teleport"""
+    units, impulses = steps.shape
+    moves = numpy.zeros((units, impulses + 1), dtype=numpy.int32)
+    moves[:, 1:] = numpy.where(resets, 0, steps)
+    anchors = numpy.empty((units, impulses + 1), dtype=numpy.int32)
+    anchors[:, 0] = starts
+    anchors[:, 1:] = targets
+    is_anchor = numpy.ones((units, impulses + 1), dtype=bool)
+    is_anchor[:, 1:] = resets
+    last_anchor = numpy.maximum.accumulate(numpy.where(is_anchor, numpy.arange(impulses + 1), 0), axis=1)
+    travelled = numpy.cumsum(moves, axis=1)
+    return (numpy.take_along_axis(anchors, last_anchor, axis=1)
+            + travelled - numpy.take_along_axis(travelled, last_anchor, axis=1))
+
+
+def get_collisions(x: numpy.ndarray, y: numpy.ndarray) -> numpy.ndarray:
+    """Units sharing a realm with another unit at each impulse"""
+    cells = (y.astype(numpy.int64) << 32) + x
+    order = numpy.argsort(cells, axis=0, kind='stable')
+    sorted_cells = numpy.take_along_axis(cells, order, axis=0)
+    same = sorted_cells[1:] == sorted_cells[:-1]
+    sorted_collisions = numpy.zeros(cells.shape, dtype=bool)
+    sorted_collisions[1:] |= same
+    sorted_collisions[:-1] |= same
+    collisions = numpy.empty(cells.shape, dtype=bool)
+    numpy.put_along_axis(collisions, order, sorted_collisions, axis=0)
+    return collisions
+
+
+@cowprof.profiled
+def simulate(moves: [], walls: numpy.ndarray=None) -> Simulation:
+    """Positions of all units at every impulse, walls is a [y, x] mask, realms off the map count as walls"""
+    import_numpy()
+    moves = [x for x in moves if not is_staying_in_limbo(x)]
+    codes_map, steps, is_teleport, targets = get_impulse_tables()
+    codes = numpy.array([[codes_map[x] for x in unit_moves.impulses] for unit_moves in moves],
+                        dtype=numpy.intp).reshape(len(moves), TOTAL_IMPULSES)
+    starts = numpy.array([unit_moves.at for unit_moves in moves], dtype=numpy.int32).reshape(len(moves), 2)
+    resets = is_teleport[codes]
+    x = get_positions(starts[:, 0], steps[codes, 0], resets, targets[codes, 0])
+    y = get_positions(starts[:, 1], steps[codes, 1], resets, targets[codes, 1])
+    moved = (x != numpy.roll(x, 1, axis=1)) | (y != numpy.roll(y, 1, axis=1))
+    digs = numpy.zeros(x.shape, dtype=bool)
+    digs[:, 1:] = codes == codes_map['D']
+    wall_moves = numpy.zeros(x.shape, dtype=bool)
+    if walls is not None:
+        on_map = (x >= 0) & (y >= 0) & (y < walls.shape[0]) & (x < walls.shape[1])
+        wall_moves[on_map] = walls[y[on_map], x[on_map]]
+        wall_moves |= ~on_map
+        wall_moves &= moved
+        wall_moves[:, 0] = False
+    return Simulation([x.unit for x in moves], x, y, moved.sum(axis=1), get_collisions(x, y), wall_moves, digs)
+
+
+def get_points_grid(turnmap_filename: str) -> numpy.ndarray:
+    """Realm points of the turn map as a [y, x] grid, walls and header cells are 0"""
+    import_numpy()
+    one_table = next(get_table(read_file(turnmap_filename), True))
+    width = max(len(x) for x in one_table)
+    points = numpy.zeros((len(one_table), width), dtype=numpy.int32)
+    for row_index, row_data in enumerate(one_table):
+        if row_index > 0:
+            realm_points = [x[0].split(' ')[0].split('-')[0] for x in row_data[1:]]
+            points[row_index, 1:len(row_data)] = [int(x) if x.isdigit() else 0 for x in realm_points]
+    return points
+
+
+def get_wall_mask(points: numpy.ndarray) -> numpy.ndarray:
+    """Walls of a get_points_grid() grid as a [y, x] mask, header cells included"""
+    return points == 0
+
+
+def get_dig_points(simulation: Simulation, points: numpy.ndarray) -> numpy.ndarray:
+    """Points every unit digs, a dig takes the realm points or 1 from a dug out realm, as graph.dig()"""
+    weights = points.copy()
+    dig_points = numpy.zeros(len(simulation.units), dtype=numpy.int64)
+    for impulse in range(1, simulation.digs.shape[1]):
+        for unit_index in numpy.nonzero(simulation.digs[:, impulse])[0]:
+            x, y = simulation.x[unit_index, impulse], simulation.y[unit_index, impulse]
+            if 0 <= y < points.shape[0] and 0 <= x < points.shape[1] and points[y, x] > 0:
+                dug = max(weights[y, x], 1)
+                weights[y, x] = dug - 1
+                dig_points[unit_index] += dug
+    return dig_points
+
+
+def print_simulation(simulation: Simulation):
+    for unit_index, impulse in zip(*numpy.nonzero(simulation.wall_moves)):
+        print('{0} moves into a wall at impulse {1}: x{2}y{3}'.format(
+            simulation.units[unit_index], impulse, simulation.x[unit_index, impulse], simulation.y[unit_index, impulse]))
+    for impulse in numpy.nonzero(simulation.collisions.any(axis=0))[0]:
+        units = [simulation.units[x] for x in numpy.nonzero(simulation.collisions[:, impulse])[0]]
+        print('Impulse {0}: {1} share realms'.format(impulse, ', '.join(units)))
+
+
+def get_costs(orders: TurnOrders) -> ():
+    xy_moves = get_xy_moves([x for x in orders.commands if isinstance(x, Move)])
     move_cost = sum(unit_move_const(unit_moves) for _, unit_moves in xy_moves.items())
-    print('Move cost: {0}'.format(move_cost))
-
-    upgrade_cost = sum(x.cost for x in get_upgrades(orders_dir, orders_filename).commands)
-    print('Upgrade cost: {0}'.format(upgrade_cost))
-
+    upgrade_cost = sum(x.cost for x in orders.commands if isinstance(x, Upgrade))
+    return xy_moves, move_cost, upgrade_cost
+
+
+def get_last_points_grid(orders_dir: str) -> numpy.ndarray:
+    result_files = sorted([x for x in get_result_files(orders_dir)], key=lambda x: x[0])
+    return get_points_grid(result_files[-1][2]) if result_files else None
+
+
+def get_last_wall_mask(orders_dir: str) -> numpy.ndarray:
+    points = get_last_points_grid(orders_dir)
+    return points == 0 if points is not None else None
+
+
+def review(orders_dir):
+    """Costs, collisions, wall moves and malformed lines of every orders file in the directory"""
+    walls = get_last_wall_mask(orders_dir)
+    print('{0:>5} {1:<8} {2:>6} {3:>6} {4:>6} {5:>7} {6:>6} {7:>6}'.format(
+        'turn', 'faction', 'orders', 'move', 'upg', 'collide', 'walls', 'errors'))
+    all_orders = get_all_orders(orders_dir)
+    for orders in all_orders:
+        simulation = simulate([x for x in orders.commands if isinstance(x, Move)], walls)
+        upgrade_cost = sum(x.cost for x in orders.commands if isinstance(x, Upgrade))
+        print('{0:>5} {1:<8} {2:>6} {3:>6} {4:>6} {5:>7} {6:>6} {7:>6}'.format(
+            orders.turn if orders.turn is not None else '-', orders.faction or '-', len(orders.commands),
+            simulation.costs.sum(), upgrade_cost, simulation.collisions[:, 1:].any(axis=0).sum(),
+            simulation.wall_moves.sum(), len(orders.errors)))
+    for orders in all_orders:
+        print_orders_errors(orders)
+
+
+def evaluate(orders_dir: str, points: numpy.ndarray, orders_filename: str) -> Evaluation:
+    """Costs, dig points, collisions, wall moves and final positions of one orders file"""
+    orders = get_orders(orders_dir, orders_filename)
+    simulation = simulate([x for x in orders.commands if isinstance(x, Move)], points == 0 if points is not None else None)
+    dig_points = get_dig_points(simulation, points).sum() if points is not None else 0
+    positions = [(unit, XY(int(simulation.x[i, -1]), int(simulation.y[i, -1]))) for i, unit in enumerate(simulation.units)]
+    return Evaluation(orders_filename, orders.faction, int(simulation.costs.sum()),
+                      sum(x.cost for x in orders.commands if isinstance(x, Upgrade)), int(dig_points),
+                      int(simulation.collisions[:, 1:].any(axis=0).sum()), int(simulation.wall_moves.sum()),
+                      positions, orders.errors)
+
+
+def compare(orders_dir: str, orders_filenames: [], jobs: int=None) -> []:
+    """Evaluates the orders files in parallel and prints them ranked, most dig points at the least cost first,
+    files with fewer errors first, lines dropped as errors would make a file look cheaper than a valid one"""
+    from concurrent.futures import ProcessPoolExecutor
+    import functools
+    points = get_last_points_grid(orders_dir)
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        evaluations = list(pool.map(functools.partial(evaluate, orders_dir, points), orders_filenames))
+    evaluations.sort(key=lambda x: (len(x.errors), -x.dig_points, x.collisions + x.wall_moves,
+                                    x.move_cost + x.upgrade_cost, x.orders_filename))
+    print('{0:>4} {1:<40} {2:<8} {3:>6} {4:>6} {5:>6} {6:>7} {7:>6} {8:>6}  {9}'.format(
+        'rank', 'orders', 'faction', 'move', 'upg', 'digs', 'collide', 'walls', 'errors', 'final positions'))
+    for rank, evaluation in enumerate(evaluations, 1):
+        print('{0:>4} {1:<40} {2:<8} {3:>6} {4:>6} {5:>6} {6:>7} {7:>6} {8:>6}  {9}'.format(
+            rank, evaluation.orders_filename, evaluation.faction or '-', evaluation.move_cost, evaluation.upgrade_cost,
+            evaluation.dig_points, evaluation.collisions, evaluation.wall_moves, len(evaluation.errors),
+            ' '.join('{0}:x{1}y{2}'.format(unit, xy.x, xy.y) for unit, xy in evaluation.positions)))
+    if points is None:
+        print('No results file, dig points are not estimated')
+    return evaluations
+
+
+def get_base_key(map_filenames: []) -> str:
+    """Cache key of the base map, changes with any of its input files"""
+    key = hashlib.sha1('{0} {1} {2}x{3}'.format(BASE_CACHE_VERSION, do_recon, REALMS_MAX_X, REALMS_MAX_Y).encode())
+    for map_filename in map_filenames:
+        map_stat = os.stat(map_filename)
+        key.update('|{0}|{1}|{2}'.format(os.path.abspath(map_filename), map_stat.st_size, map_stat.st_mtime_ns).encode())
+    return key.hexdigest()
+
+
+@cowprof.profiled
+def get_base_map(orders_dir: str) -> ():
+    """Last map of the last results and impulse files and the points grid of the last results,
+    rendered and parsed once and then read from the cache"""
+    import json
+    import_numpy()
     last_result_file = sorted([x for x in get_result_files(orders_dir)], key=lambda x: x[0])[-1]
     last_impulse_file = sorted([x for x in get_impulse_files(orders_dir)], key=lambda x: x[0])[-1]
+    key = get_base_key([last_result_file[2], last_impulse_file[2]])
+    base_filename = os.path.join(orders_dir, BASE_CACHE_DIRECTORY, key + '.png')
+    colours_filename = os.path.join(orders_dir, BASE_CACHE_DIRECTORY, key + '.json')
+    points_filename = os.path.join(orders_dir, BASE_CACHE_DIRECTORY, key + '.npy')
+    if all(os.path.exists(x) for x in [base_filename, colours_filename, points_filename]):
+        print('Using cached map {0}'.format(base_filename))
+        with open(colours_filename) as colours_file:
+            cell_colours.update(tuple(x) for x in json.load(colours_file))
+        base_image = Image.open(base_filename)
+        base_image.load()
+        return base_image, numpy.load(points_filename), last_result_file, last_impulse_file
 
     for last_file in [last_result_file, last_impulse_file]:
-        last_image = [x for x in get_maps(*last_file)][-1]
+        base_image = [x for x in get_maps(*last_file)][-1]
+    points = get_points_grid(last_result_file[2])
+    os.makedirs(os.path.dirname(base_filename), exist_ok=True)
+    base_image.save(base_filename, format='png')
+    with open(colours_filename, 'w') as colours_file:
+        json.dump(sorted(cell_colours), colours_file)
+    numpy.save(points_filename, points)
+    return base_image, points, last_result_file, last_impulse_file
+
+
+def get_plan_filename(turn_number: int, orders_filename: str, is_variant: bool) -> str:
+    if not is_variant:
+        return 'turn{0}-plan.png'.format(turn_number)
+    return 'turn{0}-plan-{1}.png'.format(turn_number, os.path.splitext(os.path.basename(orders_filename))[0])
+
+
+def main(orders_dir, orders_filenames, cost_only=False):
+    """Checks the costs of every orders file and draws each plan on the same base map"""
+    all_orders = []
+    for orders_filename in orders_filenames:
+        orders = get_orders(orders_dir, orders_filename)
+        print_orders_errors(orders)
+        xy_moves, move_cost, upgrade_cost = get_costs(orders)
+        if len(orders_filenames) > 1:
+            print('Orders: {0}'.format(orders_filename))
+        print('Move cost: {0}'.format(move_cost))
+        print('Upgrade cost: {0}'.format(upgrade_cost))
+        all_orders.append((orders_filename, orders, xy_moves))
+    if cost_only:
+        return
+
+    import_imaging()
+
+    base_image, points, last_result_file, last_impulse_file = get_base_map(orders_dir)
+    walls = get_wall_mask(points)
+    for orders_filename, orders, xy_moves in all_orders:
+        print_simulation(simulate([x for x in orders.commands if isinstance(x, Move)], walls))
+        plan_image = draw_plan(xy_moves, base_image.copy())
+        plan_image.save(get_plan_filename(last_impulse_file[0] + 1, orders_filename, len(all_orders) > 1), format='png')
 
-    plan_image = draw_plan(xy_moves, last_image)
-    plan_image.save('turn{0}-plan.png'.format(last_impulse_file[0] + 1), format='png')
 
-    
 if __name__ == '__main__':
-    main(RESULT_DIRECTORY, 'CoW_Orders_Game_g7_Turn_9_NCR.txt')
+    import argparse
+    parser = argparse.ArgumentParser(description='Check orders costs and draw the plan.')
+    parser.add_argument('orders', help='orders file names, every one gets its own plan image', nargs='*',
+                        default=['CoW_Orders_Game_g7_Turn_9_NCR.txt'])
+    parser.add_argument('-d', '--dir', help='working directory', default=RESULT_DIRECTORY)
+    parser.add_argument('-c', '--cost', help='only check the orders costs, do not draw the plan', action='store_true')
+    parser.add_argument('-a', '--all', help='review costs and errors of every orders file in the directory',
+                        action='store_true')
+    parser.add_argument('-m', '--compare', help='evaluate the orders files in parallel and print them ranked',
+                        action='store_true')
+    parser.add_argument('-j', '--jobs', help='worker processes of --compare', type=int, default=os.cpu_count())
+    parser.add_argument('--profile', help='write per stage timings to a JSON report', action='store_true')
+    args = parser.parse_args()
+    if args.profile:
+        cowprof.start()
+    if args.all:
+        review(args.dir)
+    elif args.compare:
+        compare(args.dir, args.orders, args.jobs)
+    else:
+        main(args.dir, args.orders, args.cost)
+    if args.profile:
+        cowprof.write_report('cowfart')
@@ -0,0 +1,190 @@
+#!/usr/bin/python3.8
+'''
+Copyright 2018 by EKDF Consulting and Dmitri Fedorov
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+@author: Dmitri Fedorov
+@copyright: 2020 by EKDF Consulting and Dmitri Fedorov
+@file cowgen.py
+'''
+
+# writes synthetic impulse, result and orders files of one game
+
+MAP_SIZE = 32
+TOTAL_IMPULSES = 10
+UNITS_PER_FACTION = 5
+NUMBER_OF_TURNS = 3
+WALL_DENSITY = 0.05
+GAME_ID = 'g7'
+
+HEADER_HTML_COLOUR = '#c0c0c0'
+UNOWNED_HTML_COLOUR = '#ffffff'
+WALL_HTML_COLOUR = '#808080'
+MAX_REALM_POINTS = 9
+
+from collections import namedtuple
+import os, random
+from factions import FACTION_HTML_COLOUR_MAP, FACTION_HOME_REALM_MAP
+
+# the nine factions of the 3x3 home realm layout
+HOME_FACTION_COLOURS = { faction: FACTION_HTML_COLOUR_MAP[faction] for faction in FACTION_HOME_REALM_MAP }
+
+XY = namedtuple('XY', 'x, y')
+Unit = namedtuple('Unit', 'name, faction')
+Realm = namedtuple('Realm', 'points, colour')
+
+moves = {
+    'N': lambda curr: XY(curr.x, curr.y - 1),
+    'S': lambda curr: XY(curr.x, curr.y + 1),
+    'W': lambda curr: XY(curr.x - 1, curr.y),
+    'E': lambda curr: XY(curr.x + 1, curr.y),
+    }
+
+
+def get_home_realms(size: int) -> {}:
+    """Home realms on a 3x3 grid, the same layout as FACTION_HOME_REALM_MAP on a 38 realm map"""
+    step = size / 3
+    return { faction: XY(1 + int(step * (i // 3) + step / 2), 1 + int(step * (i % 3) + step / 2))
+             for i, faction in enumerate(HOME_FACTION_COLOURS) }
+
+
+def get_realms(size: int, walls: float, home_realms: {}) -> {}:
+    """Random realm points, walls and faction territory around the home realms"""
+    radius = size / 6
+    realms = {}
+    for y in range(1, size + 1):
+        for x in range(1, size + 1):
+            xy = XY(x, y)
+            faction, home = min(home_realms.items(), key=lambda h: abs(h[1].x - x) + abs(h[1].y - y))
+            colour = HOME_FACTION_COLOURS[faction] if abs(home.x - x) + abs(home.y - y) <= radius else UNOWNED_HTML_COLOUR
+            if random.random() < walls and xy not in home_realms.values():
+                realms[xy] = Realm(0, WALL_HTML_COLOUR)
+            else:
+                realms[xy] = Realm(random.randint(1, MAX_REALM_POINTS), colour)
+    return realms
+
+
+def is_open(realms: {}, xy: XY) -> bool:
+    return xy in realms and realms[xy].points > 0
+
+
+def get_cell_html(realm: Realm, units: [], symbols: {}) -> str:
+    """Realm points and every unit stacked on it, marked with the symbol of the first unit that has one"""
+    multiplier = '<i>x2</i>' if realm.points == MAX_REALM_POINTS else ''
+    if not units:
+        return '{0}{1}'.format(realm.points, multiplier)
+    symbol = next((symbols[x] for x in units if symbols.get(x)), None)
+    return '{0}{1} {2}{3}{4}'.format(realm.points, multiplier, symbol + ' ' if symbol else '',
+                                    ' '.join('<b>{0}</b>'.format(x.name) for x in units), ' A' if symbol == '+' else '')
+
+
+def get_table_html(size: int, realms: {}, positions: {}, symbols: {}) -> str:
+    units_at = {}
+    for unit, xy in positions.items():
+        units_at.setdefault(xy, []).append(unit)
+    rows = ['<tr>' + ''.join('<td bgcolor="{0}">{1}</td>'.format(HEADER_HTML_COLOUR, x) for x in range(0, size + 1)) + '</tr>']
+    for y in range(1, size + 1):
+        cells = ['<td bgcolor="{0}">{1}</td>'.format(HEADER_HTML_COLOUR, y)]
+        for x in range(1, size + 1):
+            xy = XY(x, y)
+            cells.append('<td bgcolor="{0}">{1}</td>'.format(realms[xy].colour,
+                                                            get_cell_html(realms[xy], units_at.get(xy), symbols)))
+        rows.append('<tr>' + ''.join(cells) + '</tr>')
+    return '<table border="1">\n' + '\n'.join(rows) + '\n</table>\n'
+
+
+def play_impulse(realms: {}, positions: {}) -> {}:
+    """Moves or digs with every unit, returns the map symbol of each unit"""
+    symbols = {}
+    for unit, xy in positions.items():
+        roll = random.random()
+        if roll < 0.5:
+            step = moves[random.choice('NSWE')](xy)
+            if is_open(realms, step):
+                positions[unit] = step
+                symbols[unit] = '*'
+        elif roll < 0.8:
+            realm = realms[xy]
+            if realm.points > 1:
+                realms[xy] = Realm(realm.points - 1, realm.colour)
+        elif roll < 0.85:
+            symbols[unit] = '+'
+    return symbols
+
+
+def get_order_impulses(realms: {}, xy: XY, impulses: int) -> str:
+    order = []
+    for _ in range(0, impulses):
+        # a move, a dig or a pass, moves into walls become passes
+        command = random.choice('NSWED.')
+        if command in moves:
+            if is_open(realms, moves[command](xy)):
+                xy = moves[command](xy)
+            else:
+                command = '.'
+        order.append(command)
+    return ''.join(order)
+
+
+def write_orders(out_dir: str, game_id: str, turn: int, faction: str, realms: {}, positions: {}, impulses: int) -> str:
+    orders_filename = os.path.join(out_dir, 'CoW_Orders_Game_{0}_Turn_{1}_{2}.txt'.format(game_id, turn, faction))
+    with open(orders_filename, 'w') as orders_file:
+        orders_file.write('# {0} orders for turn {1}\n'.format(faction, turn))
+        for unit, xy in sorted(positions.items()):
+            if unit.faction == faction:
+                orders_file.write('MOV {0} {1}  # Unit is at x{2}y{3}, has {4} moves\n'.format(
+                    unit.name, get_order_impulses(realms, xy, impulses), xy.x, xy.y, impulses))
+                if random.random() < 0.2:
+                    orders_file.write('UPG {0} SK # cost is {1} rp\n'.format(unit.name, random.choice([8, 16, 24])))
+    return orders_filename
+
+
+def generate_game(out_dir: str, size: int=MAP_SIZE, impulses: int=TOTAL_IMPULSES, units: int=UNITS_PER_FACTION,
+                  turns: int=NUMBER_OF_TURNS, game_id: str=GAME_ID, walls: float=WALL_DENSITY, seed: int=1) -> []:
+    """Writes impulse and result files of every turn and orders of every faction for the next turn"""
+    random.seed(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    home_realms = get_home_realms(size)
+    realms = get_realms(size, walls, home_realms)
+    positions = { Unit('MD_{0}_{1}'.format(faction, i), faction): home
+                  for faction, home in home_realms.items() for i in range(1, units + 1) }
+    filenames = []
+    for turn in range(0, turns):
+        tables = [get_table_html(size, realms, positions, play_impulse(realms, positions)) for _ in range(0, impulses)]
+        filenames.append(os.path.join(out_dir, 'CoW_impulse_map_Turn_{0}.html'.format(turn)))
+        with open(filenames[-1], 'w') as impulse_file:
+            impulse_file.write('<html><body>\n' + ''.join(tables) + '</body></html>\n')
+        filenames.append(os.path.join(out_dir, 'CoW_Results_Game_{0}_Turn_{1}_NCR.html'.format(game_id, turn)))
+        with open(filenames[-1], 'w') as result_file:
+            result_file.write('<html><body>\n<table><tr><td>Turn</td><td>{0}</td></tr></table>\n'.format(turn)
+                              + get_table_html(size, realms, positions, {}) + '</body></html>\n')
+    for faction in HOME_FACTION_COLOURS:
+        filenames.append(write_orders(out_dir, game_id, turns, faction, realms, positions, impulses))
+    return filenames
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Write synthetic turn files of one game.')
+    parser.add_argument('dir', help='output directory')
+    parser.add_argument('-s', '--size', help='realms per map side', type=int, default=MAP_SIZE)
+    parser.add_argument('-i', '--impulses', help='impulses per turn', type=int, default=TOTAL_IMPULSES)
+    parser.add_argument('-u', '--units', help='units per faction', type=int, default=UNITS_PER_FACTION)
+    parser.add_argument('-t', '--turns', help='number of turns', type=int, default=NUMBER_OF_TURNS)
+    parser.add_argument('-w', '--walls', help='share of wall realms', type=float, default=WALL_DENSITY)
+    parser.add_argument('-g', '--game', help='game id', default=GAME_ID)
+    parser.add_argument('--seed', help='random seed', type=int, default=1)
+    args = parser.parse_args()
+    filenames = generate_game(args.dir, args.size, args.impulses, args.units, args.turns, args.game, args.walls, args.seed)
+    print('Wrote {0} files to {1}'.format(len(filenames), args.dir))
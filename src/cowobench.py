@@ -22,6 +22,8 @@ limitations under the License.
 # makes a movie out of results and generates a recon map
 
 RESULT_DIRECTORY = "C:\\Users\\dfedorov\\!nosync\\!cow"
+GAME_ID = 'g7'
+RESULT_FILE_PREFIX = 'CoW_Results_Game_'
 
 MAP_CHANGE_RATE_PER_SECOND = 10
 
@@ -36,17 +38,21 @@ RGBA = 'RGB'
 
 from html.parser import HTMLParser
 from PIL import Image, ImageDraw, ImageFont, ImageOps
-import imageio, numpy, os, datetime, itertools
+import imageio, numpy, os, datetime, itertools, csv, fnmatch
 from collections import namedtuple
+import cowprof
+from factions import FACTION_HTML_COLOUR_MAP, FACTION_HOME_REALM_MAP, FACTION_NAMES
 
 do_recon = False
-known_units = []
-known_digs = []
+included_units = []
+excluded_units = []
+known_units = {}
+known_digs = {}
 
 XY = namedtuple('XY', 'x, y')
-UnitIconPosition = namedtuple('UnitIconPosition', 'icon, position')
 
 
+@cowprof.profiled
 def get_table(data: str, is_turn_map: bool) -> []:
     """Give the data, yields one curr_table"""
 
@@ -99,6 +105,7 @@ def html_colour_to_rgba(html_colour: str) -> ():
     return tuple([int(x, 16) for x in (html_colour[:2], html_colour[2:4], html_colour[4:], '0')])
 
 
+@cowprof.profiled
 def write_on_cell(cell_image: Image, cell_content: str,
                   is_zero_cell: bool=False, zero_call_label: str=None):
     """Write text on one cell"""
@@ -120,6 +127,7 @@ def write_on_cell(cell_image: Image, cell_content: str,
         draw_context.text(CELL_POINTS_POSITION, realm_points, font=CELL_POINTS_FONT, fill=TRANSPARENT_FILL)
 
 
+@cowprof.profiled
 def write_unit_name(cell_image: Image, unit_name: str):
     """Write text on one cell"""
     CELL_POINTS_FONT_TYPE = 'seguisym.ttf'
@@ -140,23 +148,26 @@ def mark_attacked_unit(cell_image: Image, table_index: int, cell_index: int, row
     mark_unit('dagger-knife.png', cell_image, table_index, cell_index, row_index)
 
 
+@cowprof.profiled
 def mark_unit(mark_filename: str, cell_image: Image, table_index: int, cell_index: int, row_index: int):
     dir_path = os.path.dirname(os.path.realpath(__file__))
     cell_icon = Image.open(os.path.join(dir_path, mark_filename)).resize((35, 35))
     cell_image.paste(cell_icon, (7, 7), cell_icon)
     write_table_index(cell_icon, table_index)
     if do_recon:
-        known_units.append(UnitIconPosition(cell_icon, XY(cell_index, row_index)))
+        known_units.setdefault(XY(cell_index, row_index), []).append(cell_icon)
 
 
+@cowprof.profiled
 def mark_dig(cell_image: Image, table_index: int, cell_index: int, row_index: int):
     dir_path = os.path.dirname(os.path.realpath(__file__))
     cell_icon = Image.open(os.path.join(dir_path, 'dig.png')).resize((35, 35))
     cell_image.paste(cell_icon, (7, 7), cell_icon)
     write_table_index(cell_icon, table_index)
-    known_digs.append(UnitIconPosition(cell_icon, XY(cell_index, row_index)))
+    known_digs.setdefault(XY(cell_index, row_index), []).append(cell_icon)
 
 
+@cowprof.profiled
 def write_table_index(cell_image: Image, table_index: int):
     """Write table index on one cell"""
     CELL_POINTS_FONT_TYPE = 'arialbd.ttf'
@@ -168,6 +179,21 @@ def write_table_index(cell_image: Image, table_index: int):
     draw_context.text(CELL_POINTS_POSITION, str(table_index), font=CELL_POINTS_FONT, fill=TEXT_FILL)
 
 
+@cowprof.profiled
+def draw_recon(cell_image: Image, table_index: int, cell_index: int, row_index: int, cell_content: str, prev_row_data: []):
+    """Draw known units and digs on one cell, marking a new dig"""
+    for known_icon in known_units.get(XY(cell_index, row_index), ()):
+        cell_image.paste(known_icon, (7, 7), known_icon)
+    for known_icon in known_digs.get(XY(cell_index, row_index), ()):
+        cell_image.paste(known_icon, (7, 7), known_icon)
+    if prev_row_data:
+        curr_cell_content = cell_content.split(' ')[0].split('-')[0].strip()
+        prev_cell_content = prev_row_data[cell_index][0].split(' ')[0].split('-')[0].strip()
+        if not prev_cell_content == curr_cell_content:
+            mark_dig(cell_image, table_index, cell_index, row_index)
+
+
+@cowprof.profiled
 def get_one_row_image(table_index: int, zero_cell_label: str, row_index: int, row_data: [], prev_row_data: []) -> Image:
     """Build one row image from the row data"""
     row_image = Image.new(RGBA, (REALM_WIDTH * REALMS_MAX_X, REALM_HEIGHT), EMPTY_IMAGE_RGBA)
@@ -181,17 +207,7 @@ def get_one_row_image(table_index: int, zero_cell_label: str, row_index: int, ro
             write_on_cell(cell_image, cell_content)
         
         if do_recon:
-            for known_unit in known_units:
-                if known_unit.position == XY(cell_index, row_index):
-                    cell_image.paste(known_unit.icon, (7, 7), known_unit.icon)
-            for known_dig in known_digs:
-                if known_dig.position == XY(cell_index, row_index):
-                    cell_image.paste(known_dig.icon, (7, 7), known_dig.icon)
-            if prev_row_data:
-                curr_cell_content = cell_content.split(' ')[0].split('-')[0].strip()
-                prev_cell_content = prev_row_data[cell_index][0].split(' ')[0].split('-')[0].strip()
-                if not prev_cell_content == curr_cell_content:
-                    mark_dig(cell_image, table_index, cell_index, row_index)
+            draw_recon(cell_image, table_index, cell_index, row_index, cell_content, prev_row_data)
         
         if len(cell_content.split(' ')) > 1:
             cell_contents = cell_content.split(' ')
@@ -210,28 +226,80 @@ def get_one_row_image(table_index: int, zero_cell_label: str, row_index: int, ro
     return row_image
 
 
+def set_options(recon: bool, include_units: [], exclude_units: []):
+    """Sets recon and unit filters and forgets units and digs of the previous run"""
+    global do_recon, included_units, excluded_units
+    do_recon = recon
+    included_units = list(include_units or [])
+    excluded_units = list(exclude_units or [])
+    known_units.clear()
+    known_digs.clear()
+
+
+def get_unit_name(cell_content: str) -> str:
+    """Name of the unit in the cell or None"""
+    unit_names = [x for x in cell_content.split(' ')[1:] if x and x not in ['*', '+', 'A'] and not x.isdigit()]
+    return unit_names[-1] if unit_names else None
+
+
+def unit_matches(unit_name: str, pattern: str) -> bool:
+    """Matches a unit name pattern like MD_NCR_* or a faction name like NCR"""
+    return fnmatch.fnmatchcase(unit_name, pattern) or pattern in unit_name.split('_')[1:2]
+
+
+def is_unit_shown(unit_name: str) -> bool:
+    if unit_name is None:
+        return not included_units
+    if included_units and not any(unit_matches(unit_name, x) for x in included_units):
+        return False
+    return not any(unit_matches(unit_name, x) for x in excluded_units)
+
+
+@cowprof.profiled
+def filter_units(one_table: []) -> []:
+    """Drops filtered out units from the table, leaving only realm points in their cells"""
+    if not included_units and not excluded_units:
+        return one_table
+    return [[(cell_content, cell_colour)
+             if len(cell_content.split(' ')) < 2 or is_unit_shown(get_unit_name(cell_content))
+             else (cell_content.split(' ')[0], cell_colour)
+             for cell_content, cell_colour in row_data]
+            for row_data in one_table]
+
+
+@cowprof.profiled
+def read_turnmap(turnmap_filename):
+    with open(turnmap_filename) as result_file:
+        return result_file.read().replace('<b>', ' ').replace('</b>', ' ')\
+            .replace('<i>x1</i>', ' ').replace('<i>x2</i>', ' ').replace('<i>x3</i>', ' ').replace('<i>x4</i>', ' ')\
+            .replace('<i>x5</i>', ' ').replace('<i>x6</i>', ' ').replace('<i>x7</i>', ' ').replace('<i>x8</i>', ' ')\
+            .replace('<i>X1</i>', ' ').replace('<i>X2</i>', ' ').replace('<i>X3</i>', ' ').replace('<i>X4</i>', ' ')\
+            .replace('<i>X5</i>', ' ').replace('<i>X6</i>', ' ').replace('<i>X7</i>', ' ').replace('<i>X8</i>', ' ')\
+            .replace('<i>', ' ').replace('</i>', ' ')
+
+
 def get_adj_lists(map_label: str, is_turn_map: bool, turnmap_filename: str) -> Image:
     """builds one map"""
     prev_imp_table = None
     print('Processing file {0}...'.format(turnmap_filename))
-    for table_index, one_table in enumerate(get_table(open(turnmap_filename).read()
-                  .replace('<b>', ' ').replace('</b>', ' ')
-                  .replace('<i>x1</i>', ' ').replace('<i>x2</i>', ' ').replace('<i>x3</i>', ' ').replace('<i>x4</i>', ' ')
-                  .replace('<i>x5</i>', ' ').replace('<i>x6</i>', ' ').replace('<i>x7</i>', ' ').replace('<i>x8</i>', ' ')
-                  .replace('<i>X1</i>', ' ').replace('<i>X2</i>', ' ').replace('<i>X3</i>', ' ').replace('<i>X4</i>', ' ')
-                  .replace('<i>X5</i>', ' ').replace('<i>X6</i>', ' ').replace('<i>X7</i>', ' ').replace('<i>X8</i>', ' ')
-                  .replace('<i>', ' ').replace('</i>', ' '),
-                  is_turn_map)):
+    for table_index, one_table in enumerate(get_table(read_turnmap(turnmap_filename), is_turn_map)):
         print('Processing table {0}...'.format(table_index))
-        one_map = Image.new(RGBA, (REALM_WIDTH * REALMS_MAX_X, REALM_HEIGHT * REALMS_MAX_Y), EMPTY_IMAGE_RGBA)
-        for row_index, row_data in enumerate(one_table):
-            one_map.paste(get_one_row_image(table_index,
-                map_label if is_turn_map else '{0}-{1}'.format(map_label, table_index),
-                row_index, row_data,
-                prev_imp_table[row_index] if prev_imp_table else None),
-                (0, row_index * REALM_HEIGHT))
+        one_table = filter_units(one_table)
+        yield get_map_image(table_index, map_label, is_turn_map, one_table, prev_imp_table)
         prev_imp_table = one_table
-        yield one_map
+
+
+@cowprof.profiled
+def get_map_image(table_index: int, map_label: str, is_turn_map: bool, one_table: [], prev_imp_table: []) -> Image:
+    """builds the map of one table"""
+    one_map = Image.new(RGBA, (REALM_WIDTH * REALMS_MAX_X, REALM_HEIGHT * REALMS_MAX_Y), EMPTY_IMAGE_RGBA)
+    for row_index, row_data in enumerate(one_table):
+        one_map.paste(get_one_row_image(table_index,
+            map_label if is_turn_map else '{0}-{1}'.format(map_label, table_index),
+            row_index, row_data,
+            prev_imp_table[row_index] if prev_imp_table else None),
+            (0, row_index * REALM_HEIGHT))
+    return one_map
 
 
 def get_map_images(map_filenames: []) -> ():
@@ -244,11 +312,13 @@ def get_map_images(map_filenames: []) -> ():
     return map_images, last_image
 
 
+@cowprof.profiled
 def write_recon(last_image: Image, filename: str):
     last_image.save(filename, format='png')
     print('Recon PNG done: {0}'.format(filename))
 
 
+@cowprof.profiled
 def write_video(map_images: [], filename: str):
     writer = imageio.get_writer(filename, fps=MAP_CHANGE_RATE_PER_SECOND)
     last_map_image = None
@@ -262,52 +332,84 @@ def write_video(map_images: [], filename: str):
     print('Video done: {0}'.format(filename))
 
 
-# TODO: extract it from results file
-FACTION_HTML_COLOUR_MAP = {
-    'MUN': '#ff9900',
-    'WW':  '#cc9933',
-    'VUP': '#00cccc',
-    'AAK': '#ffcc66',
-    'CP':  '#006600',
-    'VOX': '#999900',
-    'TSC': '#993300',
-    'ABY': '#C00000',
-    'PAT': '#7030A0',
-    'ROD': '#00B0F0',
-    'BF4': '#66ffff',
-    'ALT': '#F4B084',
-    'NCR': '#666600',
-    'TBB': '#0070C0',
-    'WTF': '#cc66cc',
-    'SOL': '#3333ff',
-    'AP':  '#ffcc00',
-    'BF4': '#993399',
-    'DMT': '#ff0000',
-    }
-
-# TODO: extract it from results file
-FACTION_HOME_REALM_MAP = {
-    'CP':  XY(7, 7),
-    'SOL': XY(7, 19),
-    'AP':  XY(7, 31),
-    'WTF': XY(19, 7),
-    'VOX': XY(19, 19),
-    'BF4': XY(19, 31),
-    'NCR': XY(31, 7),
-    'VUP': XY(31, 19),
-    'DMT': XY(31, 31),
-    }
-
-
 def get_contrast_colour(hex_color: str, brightness_offset=50):
     rgb_hex = [hex_color[x:x + 2] for x in [1, 3, 5]]
     new_rgb_int = [int(hex_value, 16) + brightness_offset for hex_value in rgb_hex]
     new_rgb_int = [min([255, max([0, i])]) for i in new_rgb_int]  # make sure new values are between 0 and 255
     return "#" + "".join([hex(i)[2:] for i in new_rgb_int])
 
+
+
+# palette index 0 is kept for cells no faction owns
+FACTION_PALETTE = { FACTION_HTML_COLOUR_MAP[faction].lower(): index + 1 for index, faction in enumerate(FACTION_NAMES) }
+
+FactionStats = namedtuple('FactionStats', 'label, table_index, faction, cells, points, digs')
+
+
+def get_cell_points(cell_content: str) -> int:
+    """Realm points of one cell, the same token the dig marker compares"""
+    realm_points = cell_content.split(' ')[0].split('-')[0].strip()
+    return int(realm_points) if realm_points.isdigit() else 0
+
+
+def get_palette_grid(one_table: []) -> ():
+    """Flattens the realm cells of one table into palette indices and realm points"""
+    realm_cells = [cell_data for row_data in one_table[1:] for cell_data in row_data[1:]]
+    cell_colours, colour_indices = numpy.unique([(cell_colour or '').strip().lower() for _, cell_colour in realm_cells],
+                                                return_inverse=True)
+    palette = numpy.array([FACTION_PALETTE.get(cell_colour, 0) for cell_colour in cell_colours], dtype=numpy.intp)
+    realm_points = numpy.array([get_cell_points(cell_content) for cell_content, _ in realm_cells], dtype=numpy.int64)
+    return palette[colour_indices.reshape(-1)], realm_points
+
+
+@cowprof.profiled
+def get_table_stats(label: str, table_index: int, one_table: [], prev_points: numpy.ndarray) -> ():
+    """Counts owned cells, realm points and digs of every faction in one table"""
+    palette_grid, realm_points = get_palette_grid(one_table)
+    palette_size = len(FACTION_NAMES) + 1
+    owned_cells = numpy.bincount(palette_grid, minlength=palette_size)
+    total_points = numpy.bincount(palette_grid, weights=realm_points, minlength=palette_size)
+    if prev_points is not None and prev_points.shape == realm_points.shape:
+        total_digs = numpy.bincount(palette_grid, weights=(realm_points != prev_points), minlength=palette_size)
+    else:
+        total_digs = numpy.zeros(palette_size)
+    stats = [FactionStats(label, table_index, faction, int(owned_cells[index + 1]),
+                          int(total_points[index + 1]), int(total_digs[index + 1]))
+             for index, faction in enumerate(FACTION_NAMES)]
+    return stats, realm_points
+
+
+def get_faction_stats(map_files: []) -> ():
+    """Streams faction stats of every impulse and result table, digs are counted across file boundaries"""
+    prev_points = None
+    for label, is_turn_map, map_filename in map_files:
+        print('Processing file {0}...'.format(map_filename))
+        for table_index, one_table in enumerate(get_table(read_turnmap(map_filename), is_turn_map)):
+            stats, prev_points = get_table_stats(label, table_index, one_table, prev_points)
+            for faction_stats in stats:
+                yield faction_stats
+
+
+def write_faction_stats(map_files: [], filename: str):
+    with open(filename, 'w', newline='') as stats_file:
+        writer = csv.writer(stats_file)
+        writer.writerow(FactionStats._fields)
+        for faction_stats in get_faction_stats(map_files):
+            writer.writerow(faction_stats)
+    print('Faction stats done: {0}'.format(filename))
+
     
-def get_result_files(dir_name: str):
-    return get_named_files('CoW_Results_Game_g7_Turn_', dir_name)
+def get_result_files(dir_name: str, game_id: str=GAME_ID):
+    return get_named_files('{0}{1}_Turn_'.format(RESULT_FILE_PREFIX, game_id), dir_name)
+
+
+def get_game_ids(dir_name: str) -> []:
+    """Game ids of all result files in the directory"""
+    game_ids = set()
+    for file_name in os.listdir(dir_name):
+        if file_name.startswith(RESULT_FILE_PREFIX) and '_Turn_' in file_name:
+            game_ids.add(file_name[len(RESULT_FILE_PREFIX):].split('_Turn_')[0])
+    return sorted(game_ids)
     
 
 def get_impulse_files(dir_name: str):
@@ -330,10 +432,11 @@ def get_named_files(name: str, dir_name: str):
             pass
 
 
-def get_turn_map_files(work_dir: str):
+def get_all_map_files(work_dir: str, game_id: str=GAME_ID, with_impulses: bool=True):
+    """Lists impulse and result files of every turn in the order they were played"""
     MAX_TURNS = 100
-    impulse_files = [x for x in get_impulse_files(work_dir)]
-    result_files = [x for x in get_result_files(work_dir)]    
+    impulse_files = [x for x in get_impulse_files(work_dir)] if with_impulses else []
+    result_files = [x for x in get_result_files(work_dir, game_id)]    
     map_files = []
     turn_result_count = None
     for turn_number in range(0, MAX_TURNS):
@@ -342,19 +445,27 @@ def get_turn_map_files(work_dir: str):
         if not impulse_file and not result_file:
             break
         if impulse_file:
-            map_files.append(('{0}'.format(turn_number), False, os.path.join(work_dir, impulse_file[2])))
+            map_files.append(('{0}'.format(turn_number), False, impulse_file[2]))
         if result_file:
-            map_files.append(('T{0}'.format(turn_number), True, os.path.join(work_dir, result_file[2])))
+            map_files.append(('T{0}'.format(turn_number), True, result_file[2]))
         turn_result_count = turn_number
+    return turn_result_count, map_files
+
+
+def get_turn_map_files(work_dir: str, game_id: str=GAME_ID, with_impulses: bool=True):
+    turn_result_count, map_files = get_all_map_files(work_dir, game_id, with_impulses)
     print('Found {0} result files'.format(turn_result_count))
     last_turn_map_files = [x for i, x in enumerate(map_files) if x[1] and (i < turn_result_count * 2)]
     last_turn_map_files.extend(map_files[-2:])
     return turn_result_count, last_turn_map_files
 
 
-def main(do_recon, include_units, exclude_units, dir):
+def main(do_recon, include_units, exclude_units, dir, game_id=GAME_ID, out_dir='', with_impulses=True):
+    set_options(do_recon, include_units, exclude_units)
     print('Collecting result files in directory {0}...'.format(dir))
-    turn_result_count, map_files = get_turn_map_files(dir)
+    turn_result_count, map_files = get_turn_map_files(dir, game_id, with_impulses)
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
     
     print('Extracting map image files from result files...')
     map_images, last_image = get_map_images(map_files)
@@ -363,25 +474,41 @@ def main(do_recon, include_units, exclude_units, dir):
 
     if do_recon:
         print('Generating Turn {0} recon ...'.format(turn_result_count + 1))
-        write_recon(last_image, 'turn{0}-recon.png'.format(turn_result_count + 1))
+        write_recon(last_image, os.path.join(out_dir, 'turn{0}-recon.png'.format(turn_result_count + 1)))
         
     # do not write the animated PNG because nobody wants it
     # imageio.mimsave('{0}.png'.format(map_filename), map_images,
     # duration=MAP_CHANGE_RATE_PER_SECOND)
     # print('Animated PNG done.')
     
-    write_video(map_images, 'turn{0}-result.mp4'.format(turn_result_count))
+    write_video(map_images, os.path.join(out_dir, 'turn{0}-result.mp4'.format(turn_result_count)))
+
+
+def analytics(dir, filename, game_id=GAME_ID):
+    print('Collecting result files in directory {0}...'.format(dir))
+    _, map_files = get_all_map_files(dir, game_id)
+    write_faction_stats(map_files, filename)
 
 
 if __name__ == '__main__':
-    do_recon = True
-    main(do_recon, [], [], RESULT_DIRECTORY);
-    exit(0)
-    
     import argparse
     parser = argparse.ArgumentParser(description='Generate recon and plans.')
-    parser.add_argument('-d', '--dir', help='working directory', default='./')
-    parser.add_argument('-r', '--recon', help='generate recon', action='store_true', default=False)
+    parser.add_argument('-d', '--dir', help='working directory', default=RESULT_DIRECTORY)
+    parser.add_argument('-g', '--game', help='game id in result file names', default=GAME_ID)
+    parser.add_argument('-n', '--no-recon', help='do not generate recon', dest='recon', action='store_false')
+    parser.add_argument('-i', '--include', help='draw only units matching this name or faction, e.g. MD_NCR_*',
+                        action='append', default=[])
+    parser.add_argument('-x', '--exclude', help='do not draw units matching this name or faction',
+                        action='append', default=[])
+    parser.add_argument('-a', '--analytics', help='write per faction stats of every impulse to this CSV file instead of rendering')
+    parser.add_argument('--profile', help='write per stage timings to a JSON report', action='store_true')
     args = parser.parse_args()
-    main(args.recon, args.dir);
+    if args.profile:
+        cowprof.start()
+    if args.analytics:
+        analytics(args.dir, args.analytics, args.game)
+    else:
+        main(args.recon, args.include, args.exclude, args.dir, args.game)
+    if args.profile:
+        cowprof.write_report('cowobench')
 
@@ -0,0 +1,289 @@
+#!/usr/bin/python3.8
+'''
+Copyright 2018 by EKDF Consulting and Dmitri Fedorov
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+@author: Dmitri Fedorov
+@copyright: 2020 by EKDF Consulting and Dmitri Fedorov
+@file cowperf.py
+'''
+
+# times parsing, rendering, recon, encoding and whole runs on synthetic games,
+# and the graph.py planner on synthetic maps of growing size
+
+RESULTS_FILENAME = 'cowperf.jsonl'
+REPEAT = 3
+ENCODE_FRAMES = 10
+GRAPH_SIZES = [32, 64, 100, 200]
+GRAPH_FACTION = 'NCR'
+
+from collections import namedtuple, OrderedDict
+import contextlib, datetime, io, json, os, platform, statistics, subprocess, tempfile, time
+import numpy
+import cowgen, cowobench, cowert, graph
+
+Benchmark = namedtuple('Benchmark', 'name, setup')
+
+
+def get_revision() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.realpath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def get_impulse_filename(game_dir: str) -> str:
+    return sorted([x for x in cowobench.get_impulse_files(game_dir)], key=lambda x: x[0])[-1][2]
+
+
+def setup_parse(game_dir: str, out_dir: str):
+    data = cowobench.read_turnmap(get_impulse_filename(game_dir))
+    return lambda: [x for x in cowobench.get_table(data, False)]
+
+
+def setup_rasterize(game_dir: str, out_dir: str):
+    cowobench.set_options(False, [], [])
+    one_table = next(cowobench.get_table(cowobench.read_turnmap(get_impulse_filename(game_dir)), False))
+    return lambda: cowobench.get_map_image(0, '0', False, one_table, None)
+
+
+def setup_recon(game_dir: str, out_dir: str):
+    impulse_filename = get_impulse_filename(game_dir)
+    def run():
+        cowobench.set_options(True, [], [])
+        return [x for x in cowobench.get_adj_lists('0', False, impulse_filename)]
+    return run
+
+
+def setup_encode(game_dir: str, out_dir: str):
+    cowobench.set_options(False, [], [])
+    one_table = next(cowobench.get_table(cowobench.read_turnmap(get_impulse_filename(game_dir)), False))
+    map_images = [numpy.array(cowobench.get_map_image(0, '0', False, one_table, None))] * ENCODE_FRAMES
+    return lambda: cowobench.write_video(map_images, os.path.join(out_dir, 'encode.mp4'))
+
+
+def setup_cowobench(game_dir: str, out_dir: str):
+    return lambda: cowobench.main(True, [], [], game_dir, cowgen.GAME_ID, out_dir)
+
+
+def setup_cowert(game_dir: str, out_dir: str):
+    def run():
+        cowert.known_units.clear()
+        cowert.known_digs.clear()
+        curr_dir = os.getcwd()
+        os.chdir(out_dir)
+        try:
+            cowert.main(game_dir, cowert.NUMBER_OF_TURNS)
+        finally:
+            os.chdir(curr_dir)
+    return run
+
+
+BENCHMARKS = OrderedDict((x.name, x) for x in [
+    Benchmark('parse', setup_parse),
+    Benchmark('rasterize', setup_rasterize),
+    Benchmark('recon', setup_recon),
+    Benchmark('encode', setup_encode),
+    Benchmark('cowobench', setup_cowobench),
+    Benchmark('cowert', setup_cowert),
+    ])
+
+
+def get_graph_map(work_dir: str, size: int) -> (str, graph.XY):
+    """Result file of a game without units, units would be cells of their own to graph.py,
+    and the home realm of GRAPH_FACTION as a graph row and column"""
+    game_dir = os.path.join(work_dir, 'graph{0}'.format(size))
+    result_filename = cowgen.generate_game(game_dir, size=size, impulses=1, units=0, turns=1)[1]
+    home = cowgen.get_home_realms(size)[GRAPH_FACTION]
+    return result_filename, graph.XY(home.y, home.x)
+
+
+def get_uncached_distances(map_graph: graph.Graph):
+    """get_distances() without its disk cache"""
+    if len(map_graph.w) > graph.ALL_PAIRS_MAX_VERTICES:
+        return graph.DistanceRows(map_graph)
+    return graph.get_all_distances(map_graph)
+
+
+def setup_graph_parse(map_filename: str, home: graph.XY):
+    return lambda: graph.get_adj_lists(map_filename)
+
+
+def setup_graph_distances(map_filename: str, home: graph.XY):
+    """All pairs distances, None on maps too large for them"""
+    map_graph = graph.get_adj_lists(map_filename)
+    if len(map_graph.w) > graph.ALL_PAIRS_MAX_VERTICES:
+        return None
+    return lambda: graph.get_all_distances(map_graph)
+
+
+def setup_graph_rows(map_filename: str, home: graph.XY):
+    """DistanceRows of every realm a plan from home can start a turn from, on maps of any size"""
+    map_graph = graph.get_adj_lists(map_filename)
+    home_vertex = graph.get_vertex_id(map_graph, home)
+    starts = numpy.flatnonzero(graph.get_near_distances(map_graph, home_vertex, graph.HORIZON * graph.TURN_STEPS)
+                               < graph.UNREACHABLE).tolist()
+    def run():
+        rows = graph.DistanceRows(map_graph)
+        return [rows[u] for u in starts]
+    return run
+
+
+def setup_graph_bfs(map_filename: str, home: graph.XY):
+    map_graph = graph.get_adj_lists(map_filename)
+    return lambda: graph.bfs(graph.get_vertex_id(map_graph, home), graph.copy_graph(map_graph))
+
+
+def setup_graph_dfs(map_filename: str, home: graph.XY):
+    map_graph = graph.get_adj_lists(map_filename)
+    return lambda: graph.dfs(graph.get_vertex_id(map_graph, home), graph.copy_graph(map_graph))
+
+
+def setup_graph_search(map_filename: str, home: graph.XY):
+    map_graph = graph.get_adj_lists(map_filename)
+    return lambda: graph.PathSearch(map_graph).search(graph.get_vertex_id(map_graph, home))
+
+
+def setup_graph_plan(map_filename: str, home: graph.XY):
+    map_graph = graph.get_adj_lists(map_filename)
+    distances = get_uncached_distances(map_graph)
+    owned = graph.get_owner_mask(map_graph, GRAPH_FACTION)
+    return lambda: graph.plan_turns(map_graph, graph.get_vertex_id(map_graph, home), graph.HORIZON, graph.BEAM_WIDTH,
+                                    distances, graph.TranspositionTable(), 1, None, owned)
+
+
+GRAPH_BENCHMARKS = OrderedDict((x.name, x) for x in [
+    Benchmark('parse', setup_graph_parse),
+    Benchmark('distances', setup_graph_distances),
+    Benchmark('rows', setup_graph_rows),
+    Benchmark('bfs', setup_graph_bfs),
+    Benchmark('dfs', setup_graph_dfs),
+    Benchmark('search', setup_graph_search),
+    Benchmark('plan', setup_graph_plan),
+    ])
+
+
+def time_run(run, repeat: int) -> {}:
+    timings = []
+    for _ in range(0, repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start_time = time.perf_counter()
+            run()
+            timings.append(time.perf_counter() - start_time)
+    return { 'best': min(timings), 'median': statistics.median(timings), 'repeat': repeat }
+
+
+def run_benchmarks(names: [], params: {}, repeat: int) -> {}:
+    results = OrderedDict()
+    with tempfile.TemporaryDirectory() as work_dir:
+        game_dir = os.path.join(work_dir, 'game')
+        out_dir = os.path.join(work_dir, 'out')
+        os.makedirs(out_dir)
+        cowgen.generate_game(game_dir, **params)
+        for name in names:
+            print('Running {0}...'.format(name))
+            results[name] = time_run(BENCHMARKS[name].setup(game_dir, out_dir), repeat)
+    return results
+
+
+def run_graph_benchmarks(sizes: [], repeat: int) -> {}:
+    """Every graph benchmark on a map of every size, as 'benchmark/size', but those the map is too large for"""
+    results = OrderedDict()
+    with tempfile.TemporaryDirectory() as work_dir:
+        for size in sizes:
+            map_filename, home = get_graph_map(work_dir, size)
+            for name, benchmark in GRAPH_BENCHMARKS.items():
+                run = benchmark.setup(map_filename, home)
+                if run is None:
+                    print('Skipping {0} on {1}x{1}'.format(name, size))
+                    continue
+                print('Running {0} on {1}x{1}...'.format(name, size))
+                results['{0}/{1}'.format(name, size)] = time_run(run, repeat)
+    return results
+
+
+def get_previous_record(filename: str, params: {}) -> {}:
+    """The last recorded run with the same synthetic game"""
+    previous_record = None
+    if os.path.exists(filename):
+        with open(filename) as results_file:
+            for line in results_file:
+                record = json.loads(line)
+                if record.get('params') == params:
+                    previous_record = record
+    return previous_record
+
+
+def print_results(results: {}, previous_record: {}):
+    previous_results = previous_record['results'] if previous_record else {}
+    print('{0:<14} {1:>10} {2:>10} {3:>10} {4:>8}'.format('benchmark', 'best s', 'median s', 'before s', 'change'))
+    for name, result in results.items():
+        before = previous_results.get(name, {}).get('best')
+        print('{0:<14} {1:>10.4f} {2:>10.4f} {3:>10} {4:>8}'.format(
+            name, result['best'], result['median'], '{0:.4f}'.format(before) if before else '-',
+            '{0:+.1f}%'.format(100 * (result['best'] - before) / before) if before else '-'))
+    if previous_record:
+        print('Compared with {0} at revision {1}'.format(previous_record['date'], previous_record['revision']))
+
+
+def main(names: [], params: {}, repeat: int, filename: str):
+    previous_record = get_previous_record(filename, params)
+    results = run_benchmarks(names, params, repeat)
+    save_results(results, params, filename)
+    print_results(results, previous_record)
+
+
+def main_graph(sizes: [], repeat: int, filename: str):
+    params = { 'suite': 'graph', 'sizes': sizes }
+    previous_record = get_previous_record(filename, params)
+    results = run_graph_benchmarks(sizes, repeat)
+    save_results(results, params, filename)
+    print_results(results, previous_record)
+
+
+def save_results(results: {}, params: {}, filename: str):
+    record = {
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'revision': get_revision(),
+        'python': platform.python_version(),
+        'params': params,
+        'results': results,
+        }
+    with open(filename, 'a') as results_file:
+        results_file.write(json.dumps(record) + '\n')
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Benchmark rendering on a synthetic game.')
+    parser.add_argument('benchmarks', help='benchmarks to run: {0}, all by default'.format(', '.join(BENCHMARKS)),
+                        nargs='*')
+    parser.add_argument('-s', '--size', help='realms per map side', type=int, default=cowgen.MAP_SIZE)
+    parser.add_argument('-i', '--impulses', help='impulses per turn', type=int, default=cowgen.TOTAL_IMPULSES)
+    parser.add_argument('-u', '--units', help='units per faction', type=int, default=cowgen.UNITS_PER_FACTION)
+    parser.add_argument('-t', '--turns', help='number of turns', type=int, default=cowgen.NUMBER_OF_TURNS)
+    parser.add_argument('-r', '--repeat', help='runs of each benchmark', type=int, default=REPEAT)
+    parser.add_argument('-o', '--out', help='file the results are appended to', default=RESULTS_FILENAME)
+    parser.add_argument('-g', '--graph', help='time graph.py on maps of these sizes instead, {0} by default'.format(
+                        ' '.join(str(x) for x in GRAPH_SIZES)), type=int, nargs='*')
+    args = parser.parse_args()
+    if args.graph is not None:
+        main_graph(args.graph or GRAPH_SIZES, args.repeat, args.out)
+        parser.exit()
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error('unknown benchmark {0}'.format(name))
+    params = { 'size': args.size, 'impulses': args.impulses, 'units': args.units, 'turns': args.turns }
+    main(args.benchmarks or list(BENCHMARKS), params, args.repeat, args.out)
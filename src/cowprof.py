@@ -0,0 +1,153 @@
+#!/usr/bin/python3.8
+'''
+Copyright 2018 by EKDF Consulting and Dmitri Fedorov
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+@author: Dmitri Fedorov
+@copyright: 2020 by EKDF Consulting and Dmitri Fedorov
+@file cowprof.py
+'''
+
+# per stage wall time, call counts and peak memory for cowobench, cowert and cowfart
+
+SUMMARY_STAGES = 20
+# code flag of generator functions, checked directly to keep inspect out of start up
+CO_GENERATOR = 0x20
+
+import functools, time, datetime, sys
+
+try:
+    import resource
+except ImportError:
+    # no resource module on Windows, peak memory is not recorded there
+    resource = None
+
+enabled = False
+started = None
+stages = {}
+
+
+def get_peak_rss_kb() -> int:
+    """Peak resident memory of this process so far"""
+    if resource is None:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss // 1024 if sys.platform == 'darwin' else peak_rss
+
+
+def start():
+    global enabled, started
+    enabled = True
+    started = time.perf_counter()
+    stages.clear()
+
+
+def record(name: str, seconds: float, calls: int, entry_rss: int=None):
+    """Adds a stage run, its memory is how far it pushed the process peak above the peak at its entry"""
+    stage = stages.get(name)
+    if stage is None:
+        stage = stages[name] = [0, 0.0, None]
+    stage[0] += calls
+    stage[1] += seconds
+    peak_rss = get_peak_rss_kb()
+    if peak_rss is not None and entry_rss is not None:
+        stage[2] = max(stage[2] or 0, peak_rss - entry_rss)
+
+
+class TimedGenerator:
+    """Forwards to the generator and records only the time spent inside it, delegating to it with yield from
+    passes close() and throw() on as well"""
+    def __init__(self, name: str, generator):
+        self.name = name
+        self.generator = generator
+        self.calls = 1
+
+    def __iter__(self):
+        return self
+
+    def resume(self, method, *args):
+        entry_rss = get_peak_rss_kb()
+        start_time = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            record(self.name, time.perf_counter() - start_time, self.calls, entry_rss)
+            self.calls = 0
+
+    def __next__(self):
+        return self.resume(self.generator.__next__)
+
+    def send(self, value):
+        return self.resume(self.generator.send, value)
+
+    def throw(self, *args):
+        return self.resume(self.generator.throw, *args)
+
+    def close(self):
+        return self.resume(self.generator.close)
+
+
+def profiled(func):
+    """Records the function as a stage, generator stages are timed only while they run"""
+    name = func.__name__
+    if func.__code__.co_flags & CO_GENERATOR:
+        @functools.wraps(func)
+        def generator_wrapper(*args, **kwargs):
+            if not enabled:
+                return (yield from func(*args, **kwargs))
+            return (yield from TimedGenerator(name, func(*args, **kwargs)))
+        return generator_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not enabled:
+            return func(*args, **kwargs)
+        entry_rss = get_peak_rss_kb()
+        start_time = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            record(name, time.perf_counter() - start_time, 1, entry_rss)
+    return wrapper
+
+
+def get_report(tool: str) -> {}:
+    return {
+        'tool': tool,
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'wall_seconds': time.perf_counter() - started,
+        'peak_rss_kb': get_peak_rss_kb(),
+        'stages': { name: { 'calls': calls, 'seconds': seconds, 'peak_growth_kb': peak_growth }
+                    for name, (calls, seconds, peak_growth) in stages.items() },
+        }
+
+
+def write_report(tool: str, filename: str=None) -> str:
+    """Writes the JSON report and prints the slowest stages, times and peak growth of nested stages are inclusive,
+    peak growth is 0 for stages that stay under a peak reached before them"""
+    import json
+    report = get_report(tool)
+    if not filename:
+        filename = 'profile-{0}-{1}.json'.format(tool, datetime.datetime.now().strftime('%Y%m%d-%H%M%S'))
+    with open(filename, 'w') as report_file:
+        json.dump(report, report_file, indent=2)
+    print('{0:<24} {1:>9} {2:>10} {3:>8} {4:>12}'.format('stage', 'calls', 'seconds', 'wall %', 'peak +KB'))
+    wall_seconds = report['wall_seconds'] or 1
+    for name, stage in sorted(report['stages'].items(), key=lambda x: x[1]['seconds'], reverse=True)[:SUMMARY_STAGES]:
+        print('{0:<24} {1:>9} {2:>10.3f} {3:>8.1f} {4:>12}'.format(name, stage['calls'], stage['seconds'],
+                                                                  100 * stage['seconds'] / wall_seconds,
+                                                                  '-' if stage['peak_growth_kb'] is None else stage['peak_growth_kb']))
+    print('Total {0:.3f}s, peak RSS {1} KB, profile done: {2}'.format(report['wall_seconds'],
+                                                                      report['peak_rss_kb'] or '-', filename))
+    return filename
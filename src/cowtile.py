@@ -0,0 +1,249 @@
+#!/usr/bin/python3.8
+'''
+Copyright 2018 by EKDF Consulting and Dmitri Fedorov
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+@author: Dmitri Fedorov
+@copyright: 2020 by EKDF Consulting and Dmitri Fedorov
+@file cowtile.py
+'''
+
+# serves map tiles of any turn and impulse, rendered on demand
+# GET /game/<id>/turn/<n>/impulse/<k>/<z>/<x>/<y>.png
+
+TILE_SERVER_PORT = 8738
+TILE_SIZE = 256
+MAX_ZOOM = 5
+TILE_CACHE_DIRECTORY = 'tiles'
+MEMORY_CACHE_TILES = 2048
+MEMORY_CACHE_MAPS = 8
+DISK_CACHE_BYTES = 512 * 1024 * 1024
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from collections import OrderedDict
+from PIL import Image
+import io, os, re, threading
+import cowobench, cowbatch
+
+TILE_PATH = re.compile(r'^/game/([^/]+)/turn/(\d+)/impulse/(\d+)/(\d+)/(\d+)/(\d+)\.png$')
+
+games = {}
+render_lock = threading.Lock()
+cache_lock = threading.Lock()
+impulse_filenames = {}
+impulse_counts = {}
+map_cache = OrderedDict()
+tile_cache = OrderedDict()
+disk_cache = OrderedDict()
+disk_cache_bytes = 0
+
+
+def get_impulse_file(game_id: str, turn_number: int) -> str:
+    """Impulse file of the turn, the game directory is listed once for every turn found"""
+    impulse_filename = impulse_filenames.get((game_id, turn_number))
+    if impulse_filename is not None:
+        return impulse_filename
+    game = games.get(game_id)
+    if not game or not game.with_impulses:
+        return None
+    impulse_files = [x for x in cowobench.get_impulse_files(game.dir)]
+    impulse_filename = next((x[2] for x in impulse_files if x[0] == turn_number), None)
+    if impulse_filename is not None:
+        impulse_filenames[(game_id, turn_number)] = impulse_filename
+    return impulse_filename
+
+
+def cache_put(cache: OrderedDict, key: (), value, max_size: int):
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > max_size:
+        cache.popitem(last=False)
+
+
+def cache_get(cache: OrderedDict, key: ()):
+    value = cache.get(key)
+    if value is not None:
+        cache.move_to_end(key)
+    return value
+
+
+def get_map_image(impulse_filename: str, impulse_index: int, map_label: str, mtime_ns: int) -> Image:
+    """Renders one impulse table, keeping the last few maps in memory and the number of tables of every file"""
+    key = (impulse_filename, mtime_ns, impulse_index)
+    with cache_lock:
+        map_image = cache_get(map_cache, key)
+    if map_image is not None:
+        return map_image
+    with render_lock:
+        tables = [x for x in cowobench.get_table(cowobench.read_turnmap(impulse_filename), False)]
+        with cache_lock:
+            impulse_counts[(impulse_filename, mtime_ns)] = len(tables)
+        if impulse_index >= len(tables):
+            return None
+        map_image = cowobench.get_map_image(impulse_index, map_label, False, tables[impulse_index], None)
+    with cache_lock:
+        cache_put(map_cache, key, map_image, MEMORY_CACHE_MAPS)
+    return map_image
+
+
+def get_tile_box(map_image: Image, z: int, x: int, y: int) -> ():
+    """Map pixels covered by one tile, the whole map fits into one tile at zoom 0"""
+    tiles = 2 ** z
+    if x >= tiles or y >= tiles:
+        return None
+    tile_width = map_image.width / tiles
+    tile_height = map_image.height / tiles
+    return (round(x * tile_width), round(y * tile_height), round((x + 1) * tile_width), round((y + 1) * tile_height))
+
+
+def render_tile(impulse_filename: str, impulse_index: int, map_label: str, mtime_ns: int,
+                z: int, x: int, y: int) -> bytes:
+    map_image = get_map_image(impulse_filename, impulse_index, map_label, mtime_ns)
+    if map_image is None:
+        return None
+    tile_box = get_tile_box(map_image, z, x, y)
+    if tile_box is None:
+        return None
+    tile = map_image.crop(tile_box).resize((TILE_SIZE, TILE_SIZE), Image.BILINEAR)
+    tile_data = io.BytesIO()
+    tile.save(tile_data, format='png')
+    return tile_data.getvalue()
+
+
+def get_disk_filename(key: ()) -> str:
+    game_id, turn_number, impulse_index, z, x, y = key
+    return os.path.join(TILE_CACHE_DIRECTORY, game_id, str(turn_number), str(impulse_index), str(z), str(x),
+                        '{0}.png'.format(y))
+
+
+def read_disk_tile(key: (), mtime_ns: int) -> bytes:
+    tile_filename = get_disk_filename(key)
+    with cache_lock:
+        if tile_filename not in disk_cache:
+            return None
+        disk_cache.move_to_end(tile_filename)
+    try:
+        if os.stat(tile_filename).st_mtime_ns < mtime_ns:
+            return None
+        with open(tile_filename, 'rb') as tile_file:
+            return tile_file.read()
+    except OSError:
+        return None
+
+
+def write_disk_tile(key: (), tile_data: bytes):
+    global disk_cache_bytes
+    tile_filename = get_disk_filename(key)
+    os.makedirs(os.path.dirname(tile_filename), exist_ok=True)
+    with open(tile_filename, 'wb') as tile_file:
+        tile_file.write(tile_data)
+    with cache_lock:
+        disk_cache_bytes += len(tile_data) - disk_cache.pop(tile_filename, 0)
+        disk_cache[tile_filename] = len(tile_data)
+        while disk_cache_bytes > DISK_CACHE_BYTES and len(disk_cache) > 1:
+            old_filename, old_size = disk_cache.popitem(last=False)
+            disk_cache_bytes -= old_size
+            try:
+                os.remove(old_filename)
+            except OSError:
+                pass
+
+
+def load_disk_cache():
+    """Indexes tiles left by earlier runs, least recently written first"""
+    global disk_cache_bytes
+    tile_files = []
+    for dir_path, _, file_names in os.walk(TILE_CACHE_DIRECTORY):
+        for file_name in file_names:
+            tile_stat = os.stat(os.path.join(dir_path, file_name))
+            tile_files.append((tile_stat.st_mtime_ns, os.path.join(dir_path, file_name), tile_stat.st_size))
+    for _, tile_filename, tile_size in sorted(tile_files):
+        disk_cache[tile_filename] = tile_size
+        disk_cache_bytes += tile_size
+
+
+def get_tile(game_id: str, turn_number: int, impulse_index: int, z: int, x: int, y: int) -> bytes:
+    """Tile from memory, then disk, then rendered, tiles of a rewritten impulse file are rendered again,
+    impulses past the last table of the file are known missing until it is rewritten"""
+    impulse_filename = get_impulse_file(game_id, turn_number)
+    if not impulse_filename or z > MAX_ZOOM:
+        return None
+    try:
+        mtime_ns = os.stat(impulse_filename).st_mtime_ns
+    except OSError:
+        impulse_filenames.pop((game_id, turn_number), None)
+        return None
+    key = (game_id, turn_number, impulse_index, z, x, y)
+    memory_key = key + (mtime_ns,)
+    with cache_lock:
+        tile_data = cache_get(tile_cache, memory_key)
+        impulse_count = impulse_counts.get((impulse_filename, mtime_ns))
+    if tile_data is not None:
+        return tile_data
+    if impulse_count is not None and impulse_index >= impulse_count:
+        return None
+    tile_data = read_disk_tile(key, mtime_ns)
+    if tile_data is None:
+        tile_data = render_tile(impulse_filename, impulse_index, str(turn_number), mtime_ns, z, x, y)
+        if tile_data is None:
+            return None
+        write_disk_tile(key, tile_data)
+    with cache_lock:
+        cache_put(tile_cache, memory_key, tile_data, MEMORY_CACHE_TILES)
+    return tile_data
+
+
+class TileRequestHandler(BaseHTTPRequestHandler):
+    """Tile HTTP request helper"""
+
+    def do_GET(self):
+        match = TILE_PATH.match(self.path)
+        tile_data = None
+        if match:
+            game_id = match.group(1)
+            turn_number, impulse_index, z, x, y = [int(x) for x in match.groups()[1:]]
+            tile_data = get_tile(game_id, turn_number, impulse_index, z, x, y)
+        if tile_data is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', str(len(tile_data)))
+        self.send_header('Cache-Control', 'max-age=60')
+        self.end_headers()
+        self.wfile.write(tile_data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main(dirs: [], port: int):
+    cowobench.set_options(False, [], [])
+    for game in cowbatch.get_games(dirs, ''):
+        games[game.game_id] = game
+    load_disk_cache()
+    print('Serving {0} games on http://localhost:{1}/game/<id>/turn/<n>/impulse/<k>/<z>/<x>/<y>.png'
+          .format(len(games), port))
+    ThreadingHTTPServer(('localhost', port), TileRequestHandler).serve_forever()
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Serve map tiles of any turn and impulse.')
+    parser.add_argument('dirs', help='directories with result files', nargs='*', default=[cowobench.RESULT_DIRECTORY])
+    parser.add_argument('-p', '--port', help='port to listen on', type=int, default=TILE_SERVER_PORT)
+    parser.add_argument('-c', '--cache', help='tile cache directory', default=TILE_CACHE_DIRECTORY)
+    args = parser.parse_args()
+    TILE_CACHE_DIRECTORY = args.cache
+    main(args.dirs, args.port)
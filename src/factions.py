@@ -0,0 +1,65 @@
+#!/usr/bin/python3.8
+'''
+Copyright 2018 by EKDF Consulting and Dmitri Fedorov
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+@author: Dmitri Fedorov
+@copyright: 2020 by EKDF Consulting and Dmitri Fedorov
+@file factions.py
+'''
+
+# faction colours and home realms shared by every script, without any imports of their own to pay for
+
+from collections import namedtuple
+
+XY = namedtuple('XY', 'x, y')
+
+# TODO: extract it from results file
+# BF4 was listed twice, as '#66ffff' and '#993399', the second one is the colour that was used
+FACTION_HTML_COLOUR_MAP = {
+    'MUN': '#ff9900',
+    'WW':  '#cc9933',
+    'VUP': '#00cccc',
+    'AAK': '#ffcc66',
+    'CP':  '#006600',
+    'VOX': '#999900',
+    'TSC': '#993300',
+    'ABY': '#C00000',
+    'PAT': '#7030A0',
+    'ROD': '#00B0F0',
+    'ALT': '#F4B084',
+    'NCR': '#666600',
+    'TBB': '#0070C0',
+    'WTF': '#cc66cc',
+    'SOL': '#3333ff',
+    'AP':  '#ffcc00',
+    'BF4': '#993399',
+    'DMT': '#ff0000',
+    }
+
+# TODO: extract it from results file
+FACTION_HOME_REALM_MAP = {
+    'CP':  XY(7, 7),
+    'SOL': XY(7, 19),
+    'AP':  XY(7, 31),
+    'WTF': XY(19, 7),
+    'VOX': XY(19, 19),
+    'BF4': XY(19, 31),
+    'NCR': XY(31, 7),
+    'VUP': XY(31, 19),
+    'DMT': XY(31, 31),
+    }
+
+# faction index + 1 is the palette index or owner of its realms, 0 is kept for realms no faction owns
+FACTION_NAMES = sorted(FACTION_HTML_COLOUR_MAP.keys())
@@ -20,16 +20,34 @@ limitations under the License.
 '''
 
 REALMS_MIN_X = 0
-REALMS_MAX_X = 32
+# the size of the map itself when None, a smaller size keeps the units off the rest of the map
+REALMS_MAX_X = None
 
 REALMS_MIN_Y = REALMS_MIN_X
 REALMS_MAX_Y = REALMS_MAX_X
 
 WALL_VALUE = 0
 
+# distances fit in uint8, longer or impossible walks are stored as UNREACHABLE
+UNREACHABLE = 255
+DISTANCE_SOURCES_PER_PASS = 256
+DISTANCE_CACHE_DIRECTORY = '.graph'
+# larger maps get their distances a row at a time, only as far as one turn goes,
+# all pairs of 48 x 48 vertices take 5 MB
+ALL_PAIRS_MAX_VERTICES = 48 * 48
+TURN_STEPS = 3
+HORIZON = 3
+BEAM_WIDTH = 100
+TRANSPOSITIONS = 65536
+ZOBRIST_SEED = 1
+FACTION = 'NCR'
+
 from html.parser import HTMLParser
-from collections import namedtuple
-import queue, copy
+from collections import namedtuple, OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+import os, hashlib, heapq, time
+import numpy
+from factions import FACTION_HTML_COLOUR_MAP, FACTION_NAMES
 
 
 def get_table(data: str, is_turn_map: bool) -> []:
@@ -84,32 +102,223 @@ def html_colour_to_rgba(html_colour: str) -> ():
     return tuple([int(x, 16) for x in (html_colour[:2], html_colour[2:4], html_colour[4:], '0')])
 
 
+# owner of a realm is its faction index + 1, 0 for realms nobody owns
+FACTION_OWNERS = { FACTION_HTML_COLOUR_MAP[faction].lower(): index + 1 for index, faction in enumerate(FACTION_NAMES) }
+UNOWNED = 0
+
 XY = namedtuple('XY', 'x, y')
-AdjList = namedtuple('AdjList', 'w, list, vr')
 
-# (x, y): ( w, list[(x, y)], (c, d, pi) )
+# vertex v is the realm XY(v // ny, v % ny) of a map shaped (nx, ny), owned by the faction owner[v],
+# its neighbours are indices[indptr[v]:indptr[v + 1]], c, d and pi hold the search colour, distance and parent
+Graph = namedtuple('Graph', 'shape, w, walls, owner, indptr, indices, c, d, pi')
 
-VR = namedtuple('VR', 'c, d, pi')
-WHITE = 'WHITE'
-GREY = 'GREY'
-BLACK = 'BLACK'
-DEFAULT_WHITE = VR(WHITE, None, None)
+WHITE = 0
+GREY = 1
+BLACK = 2
+NIL = -1
+
+# neighbour steps in the order of the adjacency lists
+STEPS = [XY(-1, 0), XY(1, 0), XY(0, -1), XY(0, 1)]
 
 HOME_VERTEX = XY(2, 20)
 
 LOWEST_POINTS = 5
 
 
-def get_adj_lists(turnmap_filename: str) -> {}:
+def get_adj_lists(turnmap_filename: str) -> Graph:
+    return get_graph(*get_turnmap(turnmap_filename))
+
+
+def get_turnmap(turnmap_filename: str) -> (numpy.ndarray, numpy.ndarray):
+    """Realm weights and owners of the turn map"""
     for one_table in get_table(open(turnmap_filename).read().replace('<b>9</b>', '9').replace('<i>', ' ').replace('</i>', ''), True):
-        return { k: v for k, v in get_vertex_adj_lists(get_all_vertices(one_table)) }
+        weights = get_weights(get_all_vertices(one_table))
+        return weights, get_owners(get_all_colours(one_table), weights.shape)
+
+
+def get_weights(all_vertices: {}) -> numpy.ndarray:
+    """Realm weights as a [x, y] grid, cells missing from the table are walls"""
+    weights = numpy.full((max(xy.x for xy in all_vertices) + 1, max(xy.y for xy in all_vertices) + 1),
+                         WALL_VALUE, dtype=numpy.uint8)
+    for xy in all_vertices:
+        weights[xy] = get_vertex_value(all_vertices, xy)
+    return weights
+
+
+def get_owners(all_colours: {}, shape: ()) -> numpy.ndarray:
+    """Faction owners as a [x, y] grid, by the colours of FACTION_HTML_COLOUR_MAP"""
+    owners = numpy.full(shape, UNOWNED, dtype=numpy.uint8)
+    for xy, colour in all_colours.items():
+        if colour:
+            owners[xy] = FACTION_OWNERS.get(colour.strip().lower(), UNOWNED)
+    return owners
+
+
+def get_shifted(grid: numpy.ndarray, step: XY, fill) -> numpy.ndarray:
+    """The grid value at xy + step for every xy of the last two axes, fill where xy + step is off the grid"""
+    nx, ny = grid.shape[-2:]
+    result = numpy.full(grid.shape, fill, dtype=grid.dtype)
+    result[..., max(-step.x, 0):nx - max(step.x, 0), max(-step.y, 0):ny - max(step.y, 0)] = \
+        grid[..., max(step.x, 0):nx + min(step.x, 0), max(step.y, 0):ny + min(step.y, 0)]
+    return result
 
 
-def get_vertex_adj_lists(all_vertices: {}, defaul_colour: VR=DEFAULT_WHITE) -> ():
-    for curr_vertex in all_vertices.keys():
-        if not is_wall(all_vertices, curr_vertex):
-            adj_list = [x for x in get_adj_cell(all_vertices, curr_vertex)]
-            yield curr_vertex, AdjList(get_vertex_value(all_vertices, curr_vertex), adj_list, defaul_colour)
+def get_realms_max(shape: ()) -> XY:
+    """Row and column past the last realm a step can end on"""
+    return XY(shape[0] if REALMS_MAX_X is None else min(REALMS_MAX_X, shape[0]),
+              shape[1] if REALMS_MAX_Y is None else min(REALMS_MAX_Y, shape[1]))
+
+
+def get_on_map(shape: ()) -> numpy.ndarray:
+    """Realms a step can end on"""
+    realms_max = get_realms_max(shape)
+    on_map = numpy.zeros(shape, dtype=bool)
+    on_map[REALMS_MIN_X + 1:realms_max.x, REALMS_MIN_Y + 1:realms_max.y] = True
+    return on_map
+
+
+def get_graph(weights: numpy.ndarray, owners: numpy.ndarray=None) -> Graph:
+    """CSR adjacency of every realm that is not a wall, a step must stay on the map"""
+    nx, ny = weights.shape
+    owners = numpy.full(weights.shape, UNOWNED, dtype=numpy.uint8) if owners is None else owners
+    walls = weights == WALL_VALUE
+    on_map = get_on_map(weights.shape)
+    ids = numpy.arange(nx * ny, dtype=numpy.int32).reshape(nx, ny)
+    neighbours = numpy.stack([numpy.where(get_shifted(on_map & ~walls, step, False), get_shifted(ids, step, NIL), NIL)
+                              for step in STEPS], axis=-1).reshape(nx * ny, len(STEPS))
+    is_edge = (neighbours != NIL) & ~walls.reshape(nx * ny, 1)
+    indptr = numpy.zeros(nx * ny + 1, dtype=numpy.int32)
+    numpy.cumsum(is_edge.sum(axis=1), out=indptr[1:])
+    return Graph(weights.shape, weights.ravel().copy(), walls.ravel(), owners.ravel().copy(), indptr, neighbours[is_edge],
+                 numpy.zeros(nx * ny, dtype=numpy.uint8), numpy.zeros(nx * ny, dtype=numpy.int32),
+                 numpy.full(nx * ny, NIL, dtype=numpy.int32))
+
+
+def copy_graph(graph: Graph) -> Graph:
+    """A graph to search or dig on, the adjacency is shared"""
+    return graph._replace(w=graph.w.copy(), c=graph.c.copy(), d=graph.d.copy(), pi=graph.pi.copy())
+
+
+def get_all_distances(graph: Graph) -> numpy.ndarray:
+    """Steps between every two vertices, a BFS from many sources at once over the wall mask"""
+    nx, ny = graph.shape
+    distances = numpy.full((nx * ny, nx * ny), UNREACHABLE, dtype=numpy.uint8)
+    sources = numpy.flatnonzero(~graph.walls)
+    for first in range(0, len(sources), DISTANCE_SOURCES_PER_PASS):
+        pass_sources = sources[first:first + DISTANCE_SOURCES_PER_PASS]
+        distances[pass_sources] = get_sources_distances(graph, pass_sources)
+    return distances
+
+
+def get_sources_distances(graph: Graph, sources: numpy.ndarray) -> numpy.ndarray:
+    """Rows of the distances of a few open sources, one BFS pass for all of them"""
+    nx, ny = graph.shape
+    enterable = ~graph.walls.reshape(nx, ny) & get_on_map(graph.shape)
+    pass_distances = numpy.full((len(sources), nx, ny), UNREACHABLE, dtype=numpy.uint8)
+    frontier = numpy.zeros(pass_distances.shape, dtype=bool)
+    frontier.reshape(len(sources), nx * ny)[numpy.arange(len(sources)), sources] = True
+    visited = frontier.copy()
+    pass_distances[frontier] = 0
+    for distance in range(1, UNREACHABLE):
+        reached = numpy.zeros(frontier.shape, dtype=bool)
+        for step in STEPS:
+            reached |= get_shifted(frontier, XY(-step.x, -step.y), False)
+        reached &= enterable
+        reached &= ~visited
+        if not reached.any():
+            break
+        visited |= reached
+        pass_distances[reached] = distance
+        frontier = reached
+    return pass_distances.reshape(len(sources), nx * ny)
+
+
+def get_walls_key(graph: Graph) -> str:
+    """Distances depend on the walls and the map bounds only, not on the weights"""
+    key = hashlib.sha1('{0} {1} {2} {3} {4}'.format(graph.shape, REALMS_MIN_X, REALMS_MAX_X,
+                                                   REALMS_MIN_Y, REALMS_MAX_Y).encode())
+    key.update(numpy.packbits(graph.walls).tobytes())
+    return key.hexdigest()
+
+
+def get_distances(graph: Graph, cache_dir: str=DISTANCE_CACHE_DIRECTORY) -> numpy.ndarray:
+    """All pairs distances of the map, cached on disk by its walls, DistanceRows of a larger map"""
+    if len(graph.w) > ALL_PAIRS_MAX_VERTICES:
+        return DistanceRows(graph)
+    distances_filename = os.path.join(cache_dir, get_walls_key(graph) + '.npy')
+    if os.path.exists(distances_filename):
+        return numpy.load(distances_filename)
+    distances = get_all_distances(graph)
+    os.makedirs(cache_dir, exist_ok=True)
+    numpy.save(distances_filename, distances)
+    return distances
+
+
+def get_near_distances(graph: Graph, start: int, max_steps: int) -> numpy.ndarray:
+    """One row of the distances up to max_steps, a BFS over the adjacency lists"""
+    distances = numpy.full(len(graph.w), UNREACHABLE, dtype=numpy.uint8)
+    if graph.walls[start]:
+        return distances
+    distances[start] = 0
+    frontier = [start]
+    indptr, indices = graph.indptr, graph.indices
+    for distance in range(1, min(max_steps, UNREACHABLE - 1) + 1):
+        reached = []
+        for u in frontier:
+            for v in indices[indptr[u]:indptr[u + 1]].tolist():
+                if distances[v] == UNREACHABLE:
+                    distances[v] = distance
+                    reached.append(v)
+        if not reached:
+            break
+        frontier = reached
+    return distances
+
+
+class DistanceRows:
+    """Distances of a map too large for the all pairs matrix, each row searched when it is first asked for
+    and only up to max_steps, farther realms are UNREACHABLE, rows are indexed as the matrix ones"""
+
+    def __init__(self, graph: Graph, max_steps: int=TURN_STEPS):
+        self.graph = graph
+        self.max_steps = max_steps
+        self.rows = {}
+
+    def __getitem__(self, index):
+        if isinstance(index, tuple):
+            u, v = index
+            return self[u][v]
+        row = self.rows.get(index)
+        if row is None:
+            row = self.rows[index] = get_near_distances(self.graph, int(index), self.max_steps)
+        return row
+
+    def invalidate(self, graph: Graph, vertices: []):
+        """Forgets the rows of and reaching any of the vertices, the rest cannot walk through them"""
+        self.graph = graph
+        for u in [u for u, row in self.rows.items() if u in vertices or (row[vertices] < UNREACHABLE).any()]:
+            del self.rows[u]
+
+
+def is_reachable(distances: numpy.ndarray, u: int, v: int, steps: int) -> bool:
+    return distances[u, v] <= steps
+
+
+def get_reachable(distances: numpy.ndarray, u: int, steps: int) -> numpy.ndarray:
+    """Mask of the vertices at most steps away from u"""
+    return distances[u] <= steps
+
+
+def get_vertex_id(graph: Graph, xy: XY) -> int:
+    return xy.x * graph.shape[1] + xy.y
+
+
+def get_vertex_xy(graph: Graph, v: int) -> XY:
+    return XY(*divmod(int(v), graph.shape[1]))
+
+
+def get_neighbours(graph: Graph, u: int) -> []:
+    return graph.indices[graph.indptr[u]:graph.indptr[u + 1]].tolist()
 
 
 def get_vertex_value(vertices: {}, xy: XY) -> int:
@@ -120,25 +329,20 @@ def is_wall(vertices: {}, xy: XY) -> bool:
     return get_vertex_value(vertices, xy) == WALL_VALUE
 
 
-def is_on_map(xy: XY) -> bool:
-    return (xy.x > REALMS_MIN_X and xy.x < REALMS_MAX_X) and (xy.y > REALMS_MIN_X and xy.y < REALMS_MAX_Y) 
-
-
-def get_adj_cell(vertices: {}, vertex: XY) -> ():
-    for xc in [vertex.x - 1, vertex.x + 1]:
-        step = XY(xc, vertex.y)
-        if is_on_map(step) and not is_wall(vertices, step):
-            yield step
-    for yc in [vertex.y - 1, vertex.y + 1]:
-        step = XY(vertex.x, yc)
-        if is_on_map(step) and not is_wall(vertices, step):
-            yield step
+def is_on_map(xy: XY, shape: ()) -> bool:
+    realms_max = get_realms_max(shape)
+    return (xy.x > REALMS_MIN_X and xy.x < realms_max.x) and (xy.y > REALMS_MIN_Y and xy.y < realms_max.y)
 
 
 def get_all_vertices(one_table: []) -> {}:
     return { k: v for k, v in get_vertex(one_table) }
 
 
+def get_all_colours(one_table: []) -> {}:
+    return { XY(row_index, column_index): cell_data[1] for row_index, row_data in get_row(one_table)
+             for column_index, cell_data in enumerate(row_data) if column_index > REALMS_MIN_X }
+
+
 def get_vertex(one_table: []) -> ():
     for row_index, row_data in get_row(one_table):
         for column_index, cell_data in get_column(row_data):
@@ -157,80 +361,420 @@ def get_column(row_data: []) -> {}:
             yield column_index, cell_data[0]
 
 
-def colour_vertex(vertex_adj_lists: {}, xy: XY, c: str, d: int=0, p: XY=None):
-    curr_adj_list = vertex_adj_lists[xy]
-    vertex_adj_lists[xy] = AdjList(curr_adj_list.w, curr_adj_list.list, VR(c, d, p))
-
-
-def bfs(start: XY, vertex_adj_lists: {}) -> {}:
-    colour_vertex(vertex_adj_lists, start, GREY)
-    vertex_queue = queue.Queue()
-    vertex_queue.put(start)
-    while not vertex_queue.empty():
-        u = vertex_queue.get()
-        for v in vertex_adj_lists[u].list:
-            if vertex_adj_lists[v].vr.c == WHITE:
-                colour_vertex(vertex_adj_lists, v, GREY, vertex_adj_lists[u].vr.d + 1, u)
-                vertex_queue.put(v)
-        colour_vertex(vertex_adj_lists, u, BLACK, vertex_adj_lists[u].vr.d, vertex_adj_lists[u].vr.pi)
-    return vertex_adj_lists
-
-
-def dfs(start: XY, vertex_adj_lists: {}) -> {}:
-    return dfs_visit(1, start, vertex_adj_lists)
+def colour_vertex(graph: Graph, v: int, c: int, d: int=0, p: int=NIL):
+    graph.c[v] = c
+    graph.d[v] = d
+    graph.pi[v] = p
+
+
+# a realm taking a new weight, wall is whether it is a wall from now on
+CellDelta = namedtuple('CellDelta', 'v, w, wall')
+
+
+def get_cell_deltas(graph: Graph, weights: numpy.ndarray) -> []:
+    """Realms of a newer turn map that differ from the graph, the map must be of the same shape"""
+    if weights.shape != graph.shape:
+        raise ValueError('turn map of shape {0} does not match the graph shape {1}'.format(weights.shape, graph.shape))
+    weights = weights.ravel()
+    walls = weights == WALL_VALUE
+    changed = numpy.flatnonzero((weights != graph.w) | (walls != graph.walls))
+    return [CellDelta(v, w, wall) for v, w, wall in zip(changed.tolist(), weights[changed].tolist(), walls[changed].tolist())]
+
+
+def get_adjacency_row(graph: Graph, u: int) -> []:
+    """Neighbours of u as get_graph() finds them, in the order of STEPS"""
+    nx, ny = graph.shape
+    if graph.walls[u]:
+        return []
+    x, y = divmod(u, ny)
+    row = []
+    for step in STEPS:
+        xy = XY(x + step.x, y + step.y)
+        if 0 <= xy.x < nx and 0 <= xy.y < ny and is_on_map(xy, graph.shape) and not graph.walls[xy.x * ny + xy.y]:
+            row.append(xy.x * ny + xy.y)
+    return row
+
+
+def splice_adjacency(graph: Graph, rows: {}) -> Graph:
+    """The graph with the adjacency of a few vertices replaced, the rows in between are copied as blocks"""
+    degrees = numpy.diff(graph.indptr)
+    for u, row in rows.items():
+        degrees[u] = len(row)
+    indptr = numpy.zeros(len(graph.indptr), dtype=graph.indptr.dtype)
+    numpy.cumsum(degrees, out=indptr[1:])
+    indices = numpy.empty(indptr[-1], dtype=graph.indices.dtype)
+    first = 0
+    for u in sorted(rows) + [len(degrees)]:
+        indices[indptr[first]:indptr[u]] = graph.indices[graph.indptr[first]:graph.indptr[u]]
+        if u < len(degrees):
+            indices[indptr[u]:indptr[u + 1]] = rows[u]
+        first = u + 1
+    return graph._replace(indptr=indptr, indices=indices)
+
+
+def close_distances(graph: Graph, distances: numpy.ndarray, c: int):
+    """Distances once c is a wall, only the sources with a shortest walk through c are searched again"""
+    sources = numpy.flatnonzero(distances[:, c] < UNREACHABLE)
+    sources = sources[sources != c]
+    targets = numpy.flatnonzero(distances[c] < UNREACHABLE)
+    targets = targets[targets != c]
+    through = distances[sources, c].astype(numpy.int16)[:, None] + distances[c, targets]
+    affected = sources[(through == distances[numpy.ix_(sources, targets)]).any(axis=1)]
+    distances[c] = UNREACHABLE
+    distances[:, c] = UNREACHABLE
+    for first in range(0, len(affected), DISTANCE_SOURCES_PER_PASS):
+        pass_sources = affected[first:first + DISTANCE_SOURCES_PER_PASS]
+        distances[pass_sources] = get_sources_distances(graph, pass_sources)
+
+
+def open_distances(graph: Graph, distances: numpy.ndarray, c: int):
+    """Distances once c is open, every new shortest walk goes through c once"""
+    nx, ny = graph.shape
+    neighbours = get_neighbours(graph, c)
+    to_c = numpy.full(len(graph.w), UNREACHABLE, dtype=numpy.int16)
+    if is_on_map(get_vertex_xy(graph, c), graph.shape):
+        # realms stepping into c, the open realms around it
+        x, y = divmod(c, ny)
+        into = [(x + step.x) * ny + y + step.y for step in STEPS
+                if 0 <= x + step.x < nx and 0 <= y + step.y < ny and not graph.walls[(x + step.x) * ny + y + step.y]]
+        if into:
+            to_c = numpy.minimum(distances[:, into].min(axis=1).astype(numpy.int16) + 1, UNREACHABLE)
+    to_c[c] = 0
+    from_c = numpy.full(len(graph.w), UNREACHABLE, dtype=numpy.int16)
+    if neighbours:
+        from_c = numpy.minimum(distances[neighbours].min(axis=0).astype(numpy.int16) + 1, UNREACHABLE)
+    from_c[c] = 0
+    sources = numpy.flatnonzero(to_c < UNREACHABLE)
+    targets = numpy.flatnonzero(from_c < UNREACHABLE)
+    through = numpy.minimum(to_c[sources][:, None] + from_c[targets], UNREACHABLE)
+    block = numpy.ix_(sources, targets)
+    distances[block] = numpy.minimum(distances[block], through)
+
+
+def apply_cell_deltas(graph: Graph, deltas: [], distances: numpy.ndarray=None) -> Graph:
+    """Applies realm deltas from a newer turn map or a simulated dig instead of rebuilding the graph,
+    weights and distances are updated in place, a realm becoming or ceasing to be a wall gets
+    the graph new walls and adjacency arrays, so graphs copied before keep theirs"""
+    toggled = []
+    for delta in deltas:
+        graph.w[delta.v] = delta.w
+        if delta.wall != graph.walls[delta.v]:
+            toggled.append(delta)
+    if toggled:
+        graph = graph._replace(walls=graph.walls.copy())
+    nx, ny = graph.shape
+    for delta in toggled:
+        graph.walls[delta.v] = delta.wall
+        x, y = divmod(delta.v, ny)
+        affected = [delta.v] + [(x + step.x) * ny + y + step.y for step in STEPS
+                                if 0 <= x + step.x < nx and 0 <= y + step.y < ny]
+        graph = splice_adjacency(graph, { u: get_adjacency_row(graph, u) for u in affected })
+        if isinstance(distances, DistanceRows):
+            distances.invalidate(graph, affected)
+        elif distances is not None:
+            if delta.wall:
+                close_distances(graph, distances, delta.v)
+            else:
+                open_distances(graph, distances, delta.v)
+    return graph
+
+
+def bfs(start: int, graph: Graph) -> Graph:
+    colour_vertex(graph, start, GREY)
+    vertex_queue = deque([start])
+    while vertex_queue:
+        u = vertex_queue.popleft()
+        for v in get_neighbours(graph, u):
+            if graph.c[v] == WHITE:
+                colour_vertex(graph, v, GREY, graph.d[u] + 1, u)
+                vertex_queue.append(v)
+        graph.c[u] = BLACK
+    return graph
+
+
+def dfs(start: int, graph: Graph) -> Graph:
+    return dfs_visit(1, start, graph)
 
 TURN_LIMIT = 20
-
-max_points = 0
-total_points = 0
-
-max_path = []
-same_path = []
-curr_path = []
-
-def dfs_visit(turn: int, u: XY, vertex_adj_lists: {}) -> {}:
-    curr_path.append(u)
-    global total_points
-    total_points = total_points + vertex_adj_lists[u].w if turn > 1 else 0
-    result = vertex_adj_lists
-    colour_vertex(vertex_adj_lists, u, GREY)
-    for v in vertex_adj_lists[u].list:
-        if vertex_adj_lists[v].vr.c == WHITE:           
-            colour_vertex(vertex_adj_lists, v, WHITE, vertex_adj_lists[u].vr.d, u)
-            if turn <= TURN_LIMIT:
-                result = dfs_visit(turn + 1, v, vertex_adj_lists)
-    global max_points
-    global max_path
-    global same_path
-    if total_points > max_points:
-        max_points = total_points 
-        max_path = [x for x in curr_path]
-        same_path = []
-    elif total_points == max_points:
-        same_path.append([x for x in curr_path])
-    colour_vertex(vertex_adj_lists, u, BLACK) # visited
-    total_points = total_points - vertex_adj_lists[u].w if turn > 1 else 0
-    curr_path.pop()
-    return result
-
-
-def is_owner_me(xy: XY) -> bool:
-    if xy.y < 16: return False
-    if xy.y > 22: return False
-    if xy.x > 12: return False
-    if xy.y == 16:
-        if xy.x < 5: return False
-    if xy.y == 22:
-        if xy.x < 8: return False
-        if xy.x > 9: return False
-    return True
+TOP_PATHS = 10
+
+def dfs_visit(turn: int, u: int, graph: Graph) -> Graph:
+    """Colours the realms reachable within TURN_LIMIT steps of the DFS tree, on a stack of
+    (turn, vertex, neighbours left) instead of recursion"""
+    colour_vertex(graph, u, GREY)
+    stack = [(turn, u, iter(get_neighbours(graph, u)))]
+    while stack:
+        turn, u, neighbours = stack[-1]
+        for v in neighbours:
+            if graph.c[v] == WHITE:
+                colour_vertex(graph, v, WHITE, graph.d[u], u)
+                if turn <= TURN_LIMIT:
+                    colour_vertex(graph, v, GREY)
+                    stack.append((turn + 1, v, iter(get_neighbours(graph, v))))
+                    break
+        else:
+            colour_vertex(graph, u, BLACK) # visited
+            stack.pop()
+    return graph
+
+
+PathResult = namedtuple('PathResult', 'points, path')
+# a path packed into an int as a leading 1 bit and 2 bits of STEPS index per step
+PACKED_START = 1
+# nodes searched, seconds taken, whether the search ran to the end and how many points the best result may still miss
+SearchStats = namedtuple('SearchStats', 'nodes, elapsed, complete, gap')
+# searched nodes between wall clock checks
+BUDGET_CHECK_NODES = 256
+# plan states a worker expands between two budget checks of plan_turns()
+BUDGET_CHECK_STATES = 8
+
+
+class Budget:
+    """Wall clock and node limits of an anytime search, None for no limit"""
+
+    def __init__(self, max_seconds: float=None, max_nodes: int=None):
+        self.started = time.perf_counter()
+        self.deadline = None if max_seconds is None else self.started + max_seconds
+        self.max_nodes = max_nodes
+        self.nodes = 0
+
+    def is_spent(self) -> bool:
+        return (self.max_nodes is not None and self.nodes >= self.max_nodes) or \
+               (self.deadline is not None and time.perf_counter() >= self.deadline)
+
+    def spend(self, nodes: int) -> bool:
+        """Counts the nodes, False once the budget is spent"""
+        self.nodes += nodes
+        return not self.is_spent()
+
+    def get_stats(self, complete: bool, gap: int) -> SearchStats:
+        return SearchStats(self.nodes, time.perf_counter() - self.started, complete, gap)
+
+
+def get_walk_bounds(graph: Graph, weights: numpy.ndarray, limit: int) -> numpy.ndarray:
+    """Most points of any walk of r steps from every vertex, realms may repeat, so it bounds the simple paths"""
+    degrees = numpy.diff(graph.indptr)
+    bounds = numpy.zeros((limit + 1, len(weights)), dtype=numpy.int32)
+    for r in range(1, limit + 1):
+        step_points = numpy.append(weights.astype(numpy.int32)[graph.indices] + bounds[r - 1][graph.indices], 0)
+        bounds[r] = numpy.where(degrees > 0, numpy.maximum.reduceat(step_points, graph.indptr[:-1]), 0)
+    return bounds
+
+
+def get_step_index(graph: Graph, u: int, v: int) -> int:
+    """Index in STEPS of the step from u to its neighbour v"""
+    u_xy, v_xy = get_vertex_xy(graph, u), get_vertex_xy(graph, v)
+    return STEPS.index(XY(v_xy.x - u_xy.x, v_xy.y - u_xy.y))
+
+
+def unpack_path(ny: int, start: int, packed: int) -> ():
+    """Vertices of a packed path from start on a map ny realms high"""
+    steps = []
+    while packed > PACKED_START:
+        steps.append(STEPS[packed & 3])
+        packed >>= 2
+    path = [start]
+    for step in reversed(steps):
+        path.append(path[-1] + step.x * ny + step.y)
+    return tuple(path)
+
+
+class PathSearch:
+    """Branch and bound search of the simple paths of at most limit steps scoring the most points,
+    the start realm scores nothing, search() keeps its state local so one object can serve many threads"""
+
+    def __init__(self, graph: Graph, limit: int=TURN_LIMIT, top: int=TOP_PATHS, weights: numpy.ndarray=None):
+        weights = graph.w if weights is None else weights
+        self.limit = limit
+        self.top = top
+        self.weights = weights.tolist()
+        self.bounds = get_walk_bounds(graph, weights, limit).tolist()
+        self.ny = graph.shape[1]
+        self.neighbours = [[(v, get_step_index(graph, u, v)) for v in get_neighbours(graph, u)]
+                           for u in range(0, len(weights))]
+
+    def search(self, start: int, budget: Budget=None) -> ([PathResult], SearchStats):
+        """Top paths by points, deepening the limit so each pass starts with the cut off of the one before,
+        when the budget runs out the best paths found so far are returned"""
+        budget = Budget() if budget is None else budget
+        results = []
+        for depth in range(1, self.limit + 1):
+            cut_off = results[-1].points if len(results) == self.top else 0
+            found, pending_bound = self.search_depth(start, depth, cut_off, budget)
+            if pending_bound is None:
+                results = found
+                continue
+            # the paths of the depth before are still valid, some may be found again
+            paths = {}
+            for result in results + found:
+                paths.setdefault(result.path, result)
+            results = sorted(paths.values(), key=lambda x: x.points, reverse=True)[:self.top]
+            best = results[0].points if results else 0
+            upper = max(best, pending_bound) if depth == self.limit else max(best, self.bounds[self.limit][start])
+            return results, budget.get_stats(False, upper - best)
+        return results, budget.get_stats(True, 0)
+
+    def get_moves(self, u: int, total: int, remaining: int) -> []:
+        """Neighbours and their step by the most points they can lead to, best first"""
+        bounds = self.bounds[remaining - 1]
+        return sorted(((total + self.weights[v] + bounds[v], v, step) for v, step in self.neighbours[u]), reverse=True)
+
+    def get_path(self, start: int, packed: int) -> ():
+        return unpack_path(self.ny, start, packed)
+
+    def iter_optimal_paths(self, start: int, points: int=None):
+        """Lazily yields every path scoring the most points, or the given points, one at a time"""
+        if points is None:
+            results, _ = self.search(start)
+            if not results:
+                return
+            points = results[0].points
+        weights = self.weights
+        visited = bytearray(len(weights))
+        visited[start] = 1
+        path = [start]
+        totals = [0]
+        stack = [(self.get_moves(start, 0, self.limit), 0)]
+        while stack:
+            moves, index = stack.pop()
+            if index == len(moves):
+                if len(path) > 1:
+                    visited[path.pop()] = 0
+                    totals.pop()
+                continue
+            stack.append((moves, index + 1))
+            bound, v, _ = moves[index]
+            if visited[v]:
+                continue
+            if bound < points:
+                stack[-1] = (moves, len(moves))
+                continue
+            total = totals[-1] + weights[v]
+            path.append(v)
+            totals.append(total)
+            visited[v] = 1
+            if total == points:
+                yield PathResult(total, tuple(path))
+            remaining = self.limit - len(path) + 1
+            stack.append((self.get_moves(v, total, remaining) if remaining > 0 else [], 0))
+
+    def search_depth(self, start: int, depth: int, cut_off: int, budget: Budget) -> ([PathResult], int):
+        """Top paths of at most depth steps and, when the budget ran out, the bound of the moves left"""
+        weights = self.weights
+        visited = bytearray(len(weights))
+        visited[start] = 1
+        path = [start]
+        totals = [0]
+        packs = [PACKED_START]
+        # heap of (points, -found order, packed path), the first found of equal paths stays
+        found = []
+        found_count = 0
+        stack = [(self.get_moves(start, 0, depth), 0)]
+        while stack:
+            moves, index = stack.pop()
+            if index == len(moves):
+                if len(path) > 1:
+                    visited[path.pop()] = 0
+                    totals.pop()
+                    packs.pop()
+                continue
+            stack.append((moves, index + 1))
+            bound, v, step = moves[index]
+            if visited[v]:
+                continue
+            least = found[0][0] if len(found) == self.top else cut_off - 1
+            if bound <= least:
+                # moves are sorted by bound, none of the rest can do better
+                stack[-1] = (moves, len(moves))
+                continue
+            total = totals[-1] + weights[v]
+            path.append(v)
+            totals.append(total)
+            packs.append(packs[-1] << 2 | step)
+            visited[v] = 1
+            found_count += 1
+            if found_count % BUDGET_CHECK_NODES == 0 and not budget.spend(BUDGET_CHECK_NODES):
+                pending = [moves[index][0] for moves, index in stack if index < len(moves)]
+                return self.get_results(start, found), max(pending + [bound])
+            if total > least:
+                entry = (total, -found_count, packs[-1])
+                if len(found) == self.top:
+                    heapq.heapreplace(found, entry)
+                else:
+                    heapq.heappush(found, entry)
+            remaining = depth - len(path) + 1
+            stack.append((self.get_moves(v, total, remaining) if remaining > 0 else [], 0))
+        budget.spend(found_count % BUDGET_CHECK_NODES)
+        return self.get_results(start, found), None
+
+    def get_results(self, start: int, found: []) -> [PathResult]:
+        return [PathResult(points, self.get_path(start, packed)) for points, _, packed in sorted(found, reverse=True)]
+
+
+def get_owner_mask(graph: Graph, faction: str=FACTION) -> numpy.ndarray:
+    """Realms the faction owns"""
+    return graph.owner == FACTION_NAMES.index(faction) + 1
+
+
+def get_turn_adj_lists(graph: Graph, start: int, distances: numpy.ndarray,
+                       owned: numpy.ndarray) -> (numpy.ndarray, numpy.ndarray):
+    """Distances from start and the mask of the owned realms one turn can target"""
+    return distances[start], get_reachable(distances, start, TURN_STEPS) & owned
+
+
+# random keys of every realm as the position and of every realm at every weight
+Zobrist = namedtuple('Zobrist', 'position, weight')
+
+
+def get_zobrist(graph: Graph, seed: int=ZOBRIST_SEED) -> Zobrist:
+    generator = numpy.random.default_rng(seed)
+    weights = max(int(graph.w.max()) + 1, 2)
+    return Zobrist(generator.integers(0, 2 ** 64, len(graph.w), dtype=numpy.uint64).tolist(),
+                   generator.integers(0, 2 ** 64, (len(graph.w), weights), dtype=numpy.uint64).tolist())
+
+
+class DigState:
+    """Realm weights as the shared weights of the map and the few realms dug since, as vertex id: weight,
+    key is the Zobrist key of the dug realms, 0 for the map as it is"""
+    __slots__ = ('base', 'delta', 'zobrist', 'key')
+
+    def __init__(self, base: numpy.ndarray, delta: {}, zobrist: Zobrist, key: int):
+        self.base = base
+        self.delta = delta
+        self.zobrist = zobrist
+        self.key = key
+
+
+def get_dig_state(graph: Graph, zobrist: Zobrist=None) -> DigState:
+    return DigState(graph.w, {}, get_zobrist(graph) if zobrist is None else zobrist, 0)
+
+
+def copy_dig_state(dig_state: DigState) -> DigState:
+    """Costs the realms dug so far, the map weights are shared"""
+    return DigState(dig_state.base, dict(dig_state.delta), dig_state.zobrist, dig_state.key)
+
+
+def get_state_key(vertex: int, dig_state: DigState) -> int:
+    """Zobrist key of a unit at the vertex with the dig state"""
+    return dig_state.zobrist.position[vertex] ^ dig_state.key
+
+
+def get_weight(dig_state: DigState, v: int) -> int:
+    weight = dig_state.delta.get(v)
+    return int(dig_state.base[v]) if weight is None else weight
+
+
+def get_dig_weights(dig_state: DigState) -> numpy.ndarray:
+    """All realm weights of the dig state, for searches that need the whole map"""
+    weights = dig_state.base.copy()
+    if dig_state.delta:
+        weights[list(dig_state.delta.keys())] = list(dig_state.delta.values())
+    return weights
 
 
-def get_turn_adj_lists(vertex_adj_lists: {}, start: XY) -> {}:
-    #turn_adj_lists = bfs(start, copy.deepcopy(vertex_adj_lists))
-    turn_adj_lists = dfs(start, copy.deepcopy(vertex_adj_lists))
-    #return { k: v for k, v in turn_adj_lists.items() if (v.vr.d <= 3) and is_owner_me(k) }
-    return { k: v for k, v in turn_adj_lists.items() if (v.vr.c == BLACK) and is_owner_me(k) }
+def get_dig_deltas(dig_state: DigState) -> []:
+    """Realms dug by a simulated turn, a realm dug down to 0 is not a wall"""
+    return [CellDelta(v, w, False) for v, w in sorted(dig_state.delta.items())]
 
 
 def get_turn_cmd(distance: int) -> str:
@@ -246,123 +790,390 @@ def get_turn_cmd(distance: int) -> str:
         yield 'DDD'
     
 
-def get_points(from_xy: XY, to_xy: XY, cmd: str, dig_map: {}) -> int:
+def get_points(graph: Graph, from_v: int, to_v: int, cmd: str, dig_map: DigState, targets: numpy.ndarray) -> int:
     if cmd in ['DDD']:
-        yield dig(from_xy, dig_map) + dig(from_xy, dig_map) + dig(from_xy, dig_map)
+        yield dig(from_v, dig_map) + dig(from_v, dig_map) + dig(from_v, dig_map)
     elif cmd in ['SDD']:
-        yield dig(to_xy, dig_map) + dig(to_xy, dig_map)
+        yield dig(to_v, dig_map) + dig(to_v, dig_map)
     elif cmd in ['DSD']:
-        yield dig(from_xy, dig_map) + dig(to_xy, dig_map)
+        yield dig(from_v, dig_map) + dig(to_v, dig_map)
     elif cmd in ['DDS']:
-        yield dig(from_xy, dig_map) + dig(from_xy, dig_map)
+        yield dig(from_v, dig_map) + dig(from_v, dig_map)
     elif cmd in ['DSS']:
-        yield dig(from_xy, dig_map)
+        yield dig(from_v, dig_map)
     elif cmd in ['SDS']:
-        if from_xy.x == to_xy.x:
-            through_xy = XY(from_xy.x, (from_xy.y + to_xy.y) / 2)
-            yield dig(through_xy, dig_map)
-        elif from_xy.y == to_xy.y:
-            through_xy = XY((from_xy.x + to_xy.x) / 2, from_xy.y)
-            yield dig(through_xy, dig_map)
+        from_xy, to_xy = get_vertex_xy(graph, from_v), get_vertex_xy(graph, to_v)
+        if from_xy.x == to_xy.x or from_xy.y == to_xy.y:
+            yield dig((from_v + to_v) // 2, dig_map)
         else:
             for through_xy in [XY(from_xy.x, to_xy.y), XY(to_xy.x, from_xy.y)]:
-                if is_owner_me(through_xy) and (through_xy in dig_map.keys()):
-                    yield dig(through_xy, dig_map)
+                through_v = get_vertex_id(graph, through_xy)
+                if targets[through_v]:
+                    yield dig(through_v, dig_map)
     elif cmd in ['SSD']:
-        yield dig(to_xy, dig_map)
+        yield dig(to_v, dig_map)
     elif cmd in ['SSS']:
         yield 0
 
 
-def dig(xy: XY, dig_map: {}) -> int:
-    points = dig_map[xy].w
-    if points == 0: points = 1
-    curr_adj_list = dig_map[xy]
-    dig_map[xy] = AdjList(points - 1, curr_adj_list.list, curr_adj_list.vr) 
+def dig(v: int, dig_map: DigState) -> int:
+    weight = get_weight(dig_map, v)
+    points = weight if weight > 0 else 1
+    dig_map.delta[v] = points - 1
+    dig_map.key ^= dig_map.zobrist.weight[v][weight] ^ dig_map.zobrist.weight[v][points - 1]
     return points
 
 
-Path = namedtuple('Path', 'points, start, finish, cmd, dig_map, master_map')
+# start and finish are vertex ids, dig_map holds the realm weights after the turn
+Path = namedtuple('Path', 'points, start, finish, cmd, dig_map')
+
 
+# every command of get_turn_cmd(), a candidate is one command to one target
+TURN_COMMANDS = ['SSS', 'DSS', 'SDS', 'SSD', 'SDD', 'DSD', 'DDS', 'DDD']
+Candidate = numpy.dtype([('target', numpy.int32), ('cmd', numpy.uint8), ('through', numpy.int32),
+                         ('points', numpy.int32)])
+# score_turn() columns, SDS digs on the way through one of two realms, the one in the from row first as in get_points()
+SCORE_COMMANDS = numpy.array([TURN_COMMANDS.index(x) for x in
+                              ['SSS', 'DSS', 'SDS', 'SDS', 'SSD', 'SDD', 'DSD', 'DDS', 'DDD']], dtype=numpy.uint8)
+SCORE_DISTANCES = numpy.array([3, 2, 2, 2, 2, 1, 1, 1, 0])
 
-def process_turn(prev_turn_paths: {}, master_map: {}):
+
+def get_weights_at(dig_state: DigState, vertices: numpy.ndarray) -> numpy.ndarray:
+    weights = dig_state.base[vertices].astype(numpy.int32)
+    for v, weight in dig_state.delta.items():
+        weights[vertices == v] = weight
+    return weights
+
+
+def get_dig_points(weights: numpy.ndarray, digs: int) -> []:
+    """Points of digging every realm once, twice and so on up to digs times in a row, as dig()"""
+    result = []
+    points = numpy.zeros(weights.shape, dtype=numpy.int32)
+    for _ in range(0, digs):
+        weights = numpy.maximum(weights, 1)
+        points = points + weights
+        weights = weights - 1
+        result.append(points)
+    return result
+
+
+def score_turn(graph: Graph, dig_state: DigState, start: int, turn_distances: numpy.ndarray, targets: numpy.ndarray,
+               exclude: int=NIL) -> numpy.ndarray:
+    """Points of every command of get_turn_cmd() to every target at once as Candidate records, the most points
+    first and then in the order of get_points(), the dig state is only read"""
+    to = numpy.flatnonzero(targets)
+    to = to[to != exclude]
+    ny = graph.shape[1]
+    straight = (to // ny == start // ny) | (to % ny == start % ny)
+    through = numpy.stack([numpy.where(straight, (start + to) // 2, (start // ny) * ny + to % ny),
+                           (to // ny) * ny + start % ny], axis=1)
+    start_once, start_twice, start_thrice = [int(x[0]) for x in get_dig_points(get_weights_at(dig_state, numpy.array([start])), 3)]
+    to_once, to_twice = get_dig_points(get_weights_at(dig_state, numpy.concatenate([to, through.ravel()])), 2)
+    through_once = to_once[len(to):].reshape(len(to), 2)
+    to_once, to_twice = to_once[:len(to)], to_twice[:len(to)]
+
+    points = numpy.stack([numpy.zeros(len(to), dtype=numpy.int32), numpy.full(len(to), start_once),
+                          through_once[:, 0], through_once[:, 1], to_once, to_twice, start_once + to_once,
+                          numpy.full(len(to), start_twice), numpy.full(len(to), start_thrice)], axis=1)
+    is_scored = SCORE_DISTANCES == turn_distances[to][:, None]
+    is_scored[:, 2] &= straight | targets[through[:, 0]]
+    is_scored[:, 3] &= ~straight & targets[through[:, 1]]
+    rows, columns = numpy.nonzero(is_scored)
+
+    candidates = numpy.empty(len(rows), dtype=Candidate)
+    candidates['target'] = to[rows]
+    candidates['cmd'] = SCORE_COMMANDS[columns]
+    candidates['through'] = numpy.where((columns == 2) | (columns == 3), through[rows, numpy.clip(columns - 2, 0, 1)], NIL)
+    candidates['points'] = points[rows, columns]
+    return candidates[numpy.argsort(-candidates['points'], kind='stable')]
+
+
+def get_cmd_digs(from_v: int, to_v: int, cmd: str, through: int) -> []:
+    """Realms a command digs, before its first step, after its last one or between the two"""
+    digs = []
+    for index, command in enumerate(cmd):
+        if command == 'D':
+            if 'S' not in cmd[:index]:
+                digs.append(from_v)
+            elif 'S' not in cmd[index + 1:]:
+                digs.append(to_v)
+            else:
+                digs.append(through)
+    return digs
+
+
+def expand_path(graph: Graph, from_vertex: int, dig_state: DigState, distances: numpy.ndarray,
+                owned: numpy.ndarray, home: int) -> []:
+    """Paths of one turn from a realm scoring over LOWEST_POINTS, best first, each digging on its own copy,
+    no path ends on the home realm"""
+    paths = []
+    turn_distances, targets = get_turn_adj_lists(graph, from_vertex, distances, owned)
+    candidates = score_turn(graph, dig_state, from_vertex, turn_distances, targets, home)
+    for to_vertex, cmd, through, points in candidates[candidates['points'] > LOWEST_POINTS].tolist():
+        dig_map = copy_dig_state(dig_state)
+        for v in get_cmd_digs(from_vertex, to_vertex, TURN_COMMANDS[cmd], through):
+            dig(v, dig_map)
+        paths.append(Path(points, from_vertex, to_vertex, TURN_COMMANDS[cmd], dig_map))
+    return paths
+
+
+def process_turn(prev_turn_paths: {}, master_map: Graph, distances: numpy.ndarray=None, owned: numpy.ndarray=None,
+                 home: int=None):
+    """Paths of the next turn, each one digging where its previous turn left off"""
     next_turn_paths = []
-    
-    for prev_turn_path in prev_turn_paths:
-        for prev_turn_xy in prev_turn_path.dig_map:
-            prev_weight = prev_turn_path.dig_map[prev_turn_xy].w
-            curr_adj_list = master_map[prev_turn_xy]
-            master_map[prev_turn_xy] = AdjList(prev_weight, curr_adj_list.list, curr_adj_list.vr)
-        
+    distances = get_distances(master_map) if distances is None else distances
+    owned = get_owner_mask(master_map) if owned is None else owned
+    home = get_vertex_id(master_map, HOME_VERTEX) if home is None else home
     for prev_turn_path in prev_turn_paths:
-        from_vertex = prev_turn_path.finish
-        curr_turn_adj_lists = get_turn_adj_lists(master_map, from_vertex)
-        for to_vertex in curr_turn_adj_lists:
-            if not to_vertex == HOME_VERTEX:
-                for cmd in get_turn_cmd(curr_turn_adj_lists[to_vertex].vr.d):
-                    dig_map = copy.deepcopy(curr_turn_adj_lists)
-                    for points in get_points(from_vertex, to_vertex, cmd, dig_map):
-                        for xy in dig_map:
-                            curr_adj_list = master_map[xy]
-                            master_map[xy] = AdjList(dig_map[xy].w, curr_adj_list.list, curr_adj_list.vr)
-                        if points > LOWEST_POINTS:
-                            next_turn_paths.append(Path(points, from_vertex, to_vertex, cmd, copy.deepcopy(dig_map), copy.deepcopy(master_map)))
+        next_turn_paths.extend(expand_path(master_map, prev_turn_path.finish, prev_turn_path.dig_map, distances, owned,
+                                           home))
     return next_turn_paths
 
 
-def get_first_turn(master_map: {}):
-    from_vertex = HOME_VERTEX
-    first_turn_paths = []
-    turn_adj_lists = get_turn_adj_lists(master_map, from_vertex)
-    for to_vertex in turn_adj_lists:
-        if not to_vertex == HOME_VERTEX:
-            for cmd in get_turn_cmd(turn_adj_lists[to_vertex].vr.d):
-                dig_map = copy.deepcopy(turn_adj_lists)
-                for points in get_points(from_vertex, to_vertex, cmd, dig_map):
-                    for xy in dig_map:
-                        curr_adj_list = master_map[xy]
-                        master_map[xy] = AdjList(dig_map[xy].w, curr_adj_list.list, curr_adj_list.vr)
-                    if points > LOWEST_POINTS:
-                        first_turn_paths.append(Path(points, from_vertex, to_vertex, cmd, copy.deepcopy(dig_map), copy.deepcopy(master_map)))
-    return first_turn_paths
+def get_first_turn(master_map: Graph, distances: numpy.ndarray=None, owned: numpy.ndarray=None, home: int=None):
+    distances = get_distances(master_map) if distances is None else distances
+    owned = get_owner_mask(master_map) if owned is None else owned
+    home = get_vertex_id(master_map, HOME_VERTEX) if home is None else home
+    return expand_path(master_map, home, get_dig_state(master_map), distances, owned, home)
+
+
+class TranspositionTable:
+    """Bounded LRU of turn expansions by the Zobrist key of the state they start from, bound to the owned
+    realms and the home realm the expansions also depend on, plan_turns() merges equal states of one call
+    before expanding them, so hits only come from earlier calls, as the widening beams of plan_anytime()"""
+
+    def __init__(self, max_size: int=TRANSPOSITIONS):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.context = None
+        self.hits = 0
+        self.misses = 0
+        self.merges = 0
+
+    def bind(self, owned: numpy.ndarray, home: int):
+        """Binds the table to the first owned realms and home it serves, others would get wrong expansions"""
+        context = (hashlib.sha1(numpy.packbits(owned).tobytes()).hexdigest(), int(home))
+        if self.context is None:
+            self.context = context
+        assert self.context == context, 'transposition table of other owned realms or another home realm'
+
+    def get(self, key: int):
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return value
+
+    def put(self, key: int, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def get_hit_rate(self) -> float:
+        return self.hits / (self.hits + self.misses) if self.hits + self.misses else 0.0
+
+
+# the map of the plan_turns worker processes, shipped once by init_worker()
+worker_graph = None
+worker_distances = None
+worker_owned = None
+worker_home = None
+worker_zobrist = None
+
+
+def init_worker(graph: Graph, distances: numpy.ndarray, owned: numpy.ndarray, home: int, zobrist: Zobrist):
+    global worker_graph, worker_distances, worker_owned, worker_home, worker_zobrist
+    worker_graph = graph
+    worker_distances = distances
+    worker_owned = owned
+    worker_home = home
+    worker_zobrist = zobrist
+
+
+def expand_state(state: ()) -> []:
+    """expand_path() in a worker, states and paths travel as (vertex, dug realms, key) tuples"""
+    from_vertex, delta, key = state
+    dig_state = DigState(worker_graph.w, dict(delta), worker_zobrist, key)
+    return [(path.points, path.finish, path.cmd, tuple(path.dig_map.delta.items()), path.dig_map.key)
+            for path in expand_path(worker_graph, from_vertex, dig_state, worker_distances, worker_owned,
+                                    worker_home)]
+
+
+def expand_beam(graph: Graph, starts: [], dig_states: [], keys: [], distances: numpy.ndarray, owned: numpy.ndarray,
+                home: int, table: TranspositionTable, pool: ProcessPoolExecutor=None, jobs: int=1,
+                budget: Budget=None) -> []:
+    """Turn expansions of every plan of the beam, from the table or expanded, on the pool when there is one,
+    a few states at a time charging the budget a node per path, None for the plans left once it is spent"""
+    expansions = [table.get(key) for key in keys]
+    missing = OrderedDict()
+    for index, key in enumerate(keys):
+        if expansions[index] is None and key not in missing:
+            missing[key] = index
+    indices = list(missing.values())
+    zobrist = dig_states[0].zobrist
+    expanded = []
+    step = BUDGET_CHECK_STATES * max(1, jobs)
+    for first in range(0, len(indices), step):
+        if budget is not None and budget.is_spent():
+            break
+        part = indices[first:first + step]
+        if pool is None:
+            part_paths = [expand_path(graph, starts[x], dig_states[x], distances, owned, home) for x in part]
+        else:
+            states = [(starts[x], tuple(dig_states[x].delta.items()), dig_states[x].key) for x in part]
+            part_paths = [[Path(points, starts[x], finish, cmd, DigState(graph.w, dict(delta), zobrist, key))
+                           for points, finish, cmd, delta, key in paths]
+                          for x, paths in zip(part, pool.map(expand_state, states,
+                                                             chunksize=max(1, len(states) // (jobs * 4))))]
+        expanded.extend(part_paths)
+        if budget is not None:
+            budget.spend(sum(len(x) for x in part_paths))
+    expanded = dict(zip(missing.keys(), expanded))
+    for key, paths in expanded.items():
+        table.put(key, paths)
+    return [paths if paths is not None else expanded.get(key) for key, paths in zip(keys, expansions)]
+
+
+# turns planned so far, their points in total and the dig state they leave
+Plan = namedtuple('Plan', 'points, turns, dig_map')
+
+
+def get_planner_pool(graph: Graph, distances: numpy.ndarray, owned: numpy.ndarray, home: int,
+                     jobs: int) -> ProcessPoolExecutor:
+    """Workers with the map shipped once, for every plan_turns() call on it"""
+    return ProcessPoolExecutor(max_workers=jobs, initializer=init_worker,
+                               initargs=(graph, distances, owned, home, get_zobrist(graph)))
+
+
+def plan_turns(graph: Graph, start: int, horizon: int=HORIZON, beam_width: int=BEAM_WIDTH,
+               distances: numpy.ndarray=None, table: TranspositionTable=None, jobs: int=1, budget: Budget=None,
+               owned: numpy.ndarray=None, home: int=None, pool: ProcessPoolExecutor=None) -> Plan:
+    """Best plan of horizon turns on the owned realms, expanding the beam_width plans with the most points
+    turn by turn, plans ending in the same realm with the same digs are merged and their expansions reused,
+    the plan does not depend on the number of jobs, once the budget runs out, checked while a turn is expanded,
+    the plans expanded so far make the last turn and the plan is cut short of horizon,
+    no turn ends on the home realm, the start by default, a pool of get_planner_pool() is used as given,
+    without one the call starts and stops its own when jobs > 1"""
+    distances = get_distances(graph) if distances is None else distances
+    owned = get_owner_mask(graph) if owned is None else owned
+    home = start if home is None else home
+    table = TranspositionTable() if table is None else table
+    table.bind(owned, home)
+    beam = [Plan(0, (), get_dig_state(graph))]
+    own_pool = None
+    if pool is None and jobs > 1:
+        pool = own_pool = get_planner_pool(graph, distances, owned, home, jobs)
+    try:
+        for _ in range(0, horizon):
+            starts = [plan.turns[-1].finish if plan.turns else start for plan in beam]
+            keys = [get_state_key(from_vertex, plan.dig_map) for from_vertex, plan in zip(starts, beam)]
+            expansions = expand_beam(graph, starts, [plan.dig_map for plan in beam], keys, distances, owned, home,
+                                     table, pool, jobs, budget)
+            next_beam = {}
+            for plan, paths in zip(beam, expansions):
+                for path in paths or ():
+                    next_key = get_state_key(path.finish, path.dig_map)
+                    merged = next_beam.get(next_key)
+                    if merged is not None:
+                        table.merges += 1
+                        if merged.points >= plan.points + path.points:
+                            continue
+                    next_beam[next_key] = Plan(plan.points + path.points, plan.turns + (path,), path.dig_map)
+            if not next_beam:
+                break
+            # stable, the first expanded of equal plans stays
+            beam = heapq.nlargest(beam_width, next_beam.values(), key=lambda x: x.points)
+            if budget is not None and budget.is_spent():
+                break
+    finally:
+        if own_pool is not None:
+            own_pool.shutdown()
+    return beam[0]
+
+
+def get_turn_bound(graph: Graph) -> int:
+    """Most points one turn can score, three digs of the richest realm"""
+    return int(get_dig_points(numpy.array([graph.w.max()], dtype=numpy.int32), 3)[-1][0])
+
+
+def plan_anytime(graph: Graph, start: int, horizon: int=HORIZON, beam_width: int=BEAM_WIDTH,
+                 distances: numpy.ndarray=None, table: TranspositionTable=None, jobs: int=1,
+                 budget: Budget=None, owned: numpy.ndarray=None, home: int=None) -> (Plan, SearchStats):
+    """Plans with a beam of 1, 2, 4 and so on up to beam_width while the budget lasts, on one pool of workers,
+    the best full horizon plan so far and the points it may miss against the most a plan can score"""
+    distances = get_distances(graph) if distances is None else distances
+    owned = get_owner_mask(graph) if owned is None else owned
+    home = start if home is None else home
+    table = TranspositionTable() if table is None else table
+    budget = Budget() if budget is None else budget
+    best = None
+    width = 1
+    complete = False
+    pool = get_planner_pool(graph, distances, owned, home, jobs) if jobs > 1 else None
+    try:
+        while True:
+            plan = plan_turns(graph, start, horizon, min(width, beam_width), distances, table, jobs, budget, owned,
+                              home, pool)
+            is_spent = budget.is_spent()
+            if best is None or (not is_spent or len(plan.turns) == horizon) and plan.points > best.points:
+                best = plan
+            if is_spent:
+                break
+            if width >= beam_width:
+                complete = True
+                break
+            width *= 2
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return best, budget.get_stats(complete, max(0, horizon * get_turn_bound(graph) - best.points))
 
 
 if __name__ == '__main__':
-    map_filenames = [
-        '/Users/Dmitri Fedorov/Google Drive/cow2/turnmaps/CoW_Results_Game_2_Turn_9_NCR.html',
-    ]
-    for map_filename in map_filenames:
-        vertex_adj_lists = get_adj_lists(map_filename)
-        print(len(vertex_adj_lists))
-
-        from_vertex = HOME_VERTEX
-        first_turn_paths = []
-        turn_adj_lists = get_turn_adj_lists(vertex_adj_lists, from_vertex)
-        print(len(turn_adj_lists))
-        #print([x for x in list(max_path.queue)])
-        print(max_points, max_path)
-        print([x for x in same_path])
-        #first_turn_paths = get_first_turn(vertex_adj_lists)
-        #print(len(first_turn_paths))
-        #second_turn_paths = process_turn(first_turn_paths, vertex_adj_lists)
-        #print(len(second_turn_paths))
-        #third_turn_paths = process_turn(second_turn_paths, vertex_adj_lists)
-        #print(len(third_turn_paths))
-        
-        quit(0)
-        most_points = 0
-        path = None
-        for first_turn_path in first_turn_paths:
-            for second_turn_path in second_turn_paths:
-                for third_turn_path in third_turn_paths:
-                    if first_turn_path.finish == second_turn_path.start and second_turn_path.finish == third_turn_path.start:
-                        total = first_turn_path.points + second_turn_path.points + third_turn_path.points
-                        if total > most_points:
-                            most_points = total
-                            path = (first_turn_path, second_turn_path, third_turn_path)
-        
-        print(most_points, path[0].start, path[0].finish, path[0].cmd, path[1].start, path[1].finish, path[1].cmd, path[2].start, path[2].finish, path[2].cmd)
-
-        # print(path[0].master_map)
-        # print(path[1].master_map)
-        # print(path[2].master_map)
+    import argparse
+    parser = argparse.ArgumentParser(description='Plan the turns scoring the most points on a turn map.')
+    parser.add_argument('maps', help='turn map file names', nargs='*',
+                        default=['/Users/Dmitri Fedorov/Google Drive/cow2/turnmaps/CoW_Results_Game_2_Turn_9_NCR.html'])
+    parser.add_argument('-t', '--turns', help='turns to plan', type=int, default=HORIZON)
+    parser.add_argument('-b', '--beam', help='plans kept after each turn', type=int, default=BEAM_WIDTH)
+    parser.add_argument('-s', '--seconds', help='time budget of each search', type=float)
+    parser.add_argument('-n', '--nodes', help='node budget of each search', type=int)
+    parser.add_argument('-j', '--jobs', help='worker processes expanding the plans', type=int, default=os.cpu_count())
+    parser.add_argument('-f', '--faction', help='faction to plan for', choices=FACTION_NAMES, default=FACTION)
+    parser.add_argument('-o', '--home', help='realm the units start from', type=int, nargs=2, metavar=('X', 'Y'),
+                        default=HOME_VERTEX)
+    args = parser.parse_args()
+    graph = None
+    for map_filename in args.maps:
+        weights, owners = get_turnmap(map_filename)
+        if graph is None or weights.shape != graph.shape:
+            graph = get_graph(weights, owners)
+            distances = get_distances(graph)
+        else:
+            deltas = get_cell_deltas(graph, weights)
+            # owners do not change the adjacency or the distances
+            graph = apply_cell_deltas(graph, deltas, distances)._replace(owner=owners.ravel())
+            print('{0} realms changed, {1} walls'.format(len(deltas), sum(x.wall for x in deltas)))
+        print(numpy.count_nonzero(~graph.walls))
+
+        owned = get_owner_mask(graph, args.faction)
+        from_vertex = get_vertex_id(graph, XY(*args.home))
+        turn_distances, targets = get_turn_adj_lists(graph, from_vertex, distances, owned)
+        print(numpy.count_nonzero(targets))
+        best_paths, stats = PathSearch(graph).search(from_vertex, Budget(args.seconds, args.nodes))
+        for best_path in best_paths:
+            print(best_path.points, [get_vertex_xy(graph, x) for x in best_path.path])
+        print(stats)
+
+        table = TranspositionTable()
+        plan, stats = plan_anytime(graph, from_vertex, args.turns, args.beam, distances, table, args.jobs,
+                                   Budget(args.seconds, args.nodes), owned)
+        print(plan.points, stats)
+        print('Transpositions reused across beam widths: {0} hits, {1} misses, {2} plans merged'.format(
+            table.hits, table.misses, table.merges))
+        for turn_path in plan.turns:
+            print(turn_path.points, get_vertex_xy(graph, turn_path.start), get_vertex_xy(graph, turn_path.finish),
+                  turn_path.cmd, turn_path.dig_map.delta)